@@ -9,24 +9,35 @@ See the LICENSE.TXT file for more details.
 Author : Cyril Waechter
 """
 
+import queue
+import shutil
+import tempfile
+import threading
 import xml.etree.ElementTree as ET
+from xml.sax.saxutils import quoteattr
 import typing
 import ifcopenshell
 import ifcopenshell.geom
 import ifcopenshell.util
 
+import numpy as np
+
 import FreeCAD
 
 if typing.TYPE_CHECKING:
     from freecad.bem.entities import *
 
 SCALE = 1000
+# Decimals kept for coordinates written in metres: 4 → 0.1 mm. None keeps full float precision.
+COORDINATE_DECIMALS = 4
 
 
-class BEMxml:
+class BEMxmlWriter:
     """Contains methods to write each kind of object to BEMxml"""
 
-    def __init__(self, model=None):
+    coordinate_decimals = COORDINATE_DECIMALS
+
+    def __init__(self, model=None, geometry_store=None, geometry_sidecar=None):
         self.root = ET.Element("bimbem")
         self.tree = ET.ElementTree(self.root)
         self.projects = ET.SubElement(self.root, "Projects")
@@ -41,6 +52,17 @@ class BEMxml:
         self.buildings = None
         self.storeys = None
         self.model = model
+        # Optional GeometryStore from which polygons are read instead of FreeCAD shapes
+        self.geometry_store = geometry_store
+        # If True polygons found in geometry_store are only referenced. See write_stored_polygons.
+        self.reference_geometry = False
+        # Optional GeometrySidecarWriter. Polygons are then referenced by index instead of written as points
+        self.geometry_sidecar = geometry_sidecar
+        self._geometry_settings = None
+
+    def write_processing_tier(self, tier: str) -> None:
+        """Record which pipeline tier produced this xml"""
+        self.root.set("ProcessingTier", tier)
 
     @staticmethod
     def write_id(xml_element, model_element):
@@ -163,7 +185,7 @@ class BEMxml:
         for fc_inner_b in fc_object.InnerBoundaries:
             ET.SubElement(inner_boundaries, "InnerBoundary").text = str(fc_inner_b.Id)
 
-        self.write_fc_polygon(boundary, fc_object)
+        self.write_fc_polygon(boundary, fc_object, (fc_object.Id, "Boundary"))
         self.write_attributes(boundary, fc_object, ("UndergroundDepth",))
 
         is_hosted = fc_object.IsHosted
@@ -182,7 +204,7 @@ class BEMxml:
             for geo_type in ("SIA_Interior", "SIA_Exterior"):
                 geo = ET.SubElement(boundary, geo_type)
                 fc_geo = getattr(fc_object, geo_type)
-                self.write_fc_polygon(geo, fc_geo)
+                self.write_fc_polygon(geo, fc_geo, (fc_object.Id, geo_type))
 
     def write_building_element_types(self, fc_object):
         building_element_types = ET.SubElement(self.building_element_types, "BuildingElementType")
@@ -235,34 +257,68 @@ class BEMxml:
                 else:
                     ET.SubElement(part, attrib).text = str(value)
 
-    def write_shade(self, model_element):
+    def write_shade(self, model_element, vertices=None):
+        """vertices: optional (n, 3) array in metres already computed at import"""
         shade = ET.SubElement(self.shades, "Shade")
         self.write_root_attrib(shade, model_element)
-        self.write_polygon(shade, model_element)
+        self.write_polygon(shade, model_element, vertices)
 
-    def write_polygon(self, xml_element, boundary):
-        surface = boundary.ConnectionGeometry.SurfaceOnRelatingElement
-        settings = ifcopenshell.geom.settings()
-        shape = ifcopenshell.geom.create_shape(settings, surface)
+    def write_polygon(self, xml_element, boundary, vertices=None):
+        if vertices is None:
+            surface = boundary.ConnectionGeometry.SurfaceOnRelatingElement
+            shape = ifcopenshell.geom.create_shape(self.geometry_settings(), surface)
+            vertices = ifcopenshell.util.shape.get_vertices(shape)
         geom = ET.SubElement(xml_element, "geom")
-        polygon = ET.SubElement(geom, "Polygon")
-        for v in ifcopenshell.util.shape.get_vertices(shape):
-            ET.SubElement(polygon, "point", array_to_vector_dict(v))
+        self.write_rings(geom, [vertices])
 
-    @staticmethod
-    def write_fc_polygon(xml_element, fc_object):
+    def geometry_settings(self):
+        if self._geometry_settings is None:
+            self._geometry_settings = ifcopenshell.geom.settings()
+        return self._geometry_settings
+
+    def write_fc_polygon(self, xml_element, fc_object, key=None):
+        """key: (boundary id, kind) under which polygon is optionally read from geometry_store"""
         geom = ET.SubElement(xml_element, "geom")
-        try:
-            wires = fc_object.Proxy.get_wires(fc_object)
-        except AttributeError:
-            wires = ()
-        for wire in wires:
-            polygon = ET.SubElement(geom, "Polygon")
-            for vertex in wire.Vertexes:
-                ET.SubElement(polygon, "point", vector_to_dict(vertex.Point))
+        store = self.geometry_store
+        index = store.index(*key) if store is not None and key else None
+        if index is not None and self.reference_geometry:
+            geom.attrib.update({"boundary": str(key[0]), "kind": key[1]})
+        else:
+            if index is not None:
+                rings = [ring / SCALE for ring in store.rings(index)]
+            else:
+                try:
+                    wires = fc_object.Proxy.get_wires(fc_object)
+                except AttributeError:
+                    wires = ()
+                rings = [np.array([tuple(v.Point) for v in wire.Vertexes]).reshape(-1, 3) / SCALE for wire in wires]
+            self.write_rings(geom, rings)
         ET.SubElement(xml_element, "Area").text = fc_area_to_si_xml(fc_object.Area)
         ET.SubElement(xml_element, "AreaWithHosted").text = fc_area_to_si_xml(fc_object.AreaWithHosted)
 
+    def write_stored_polygons(self, root, store) -> None:
+        """Write polygons referenced from store by geom elements of an xml written with reference_geometry.
+        Used to move polygons from worker processes through shared memory instead of xml text."""
+        for geom in root.iter("geom"):
+            if "kind" not in geom.attrib:
+                continue
+            index = store.index(int(geom.attrib.pop("boundary")), geom.attrib.pop("kind"))
+            self.write_rings(geom, [ring / SCALE for ring in store.rings(index)])
+
+    def write_rings(self, geom, rings) -> None:
+        """rings: (n, 3) arrays in metres, outer ring first"""
+        if self.geometry_sidecar is not None:
+            geom.set("index", str(self.geometry_sidecar.add(rings)))
+            return
+        for ring in rings:
+            polygon = ET.SubElement(geom, "Polygon")
+            for x, y, z in format_points(ring, self.coordinate_decimals):
+                ET.SubElement(polygon, "point", {"x": x, "y": y, "z": z})
+
+    def write_geometry_file(self, file_name: str) -> None:
+        """Record name of geometry sidecar file polygons indexes refer to"""
+        self.root.set("GeometryFile", file_name)
+
     @staticmethod
     def append_id_element(xml_element, fc_object, name):
         value = getattr(fc_object, name)
@@ -272,6 +328,10 @@ class BEMxml:
     def append_text_element(xml_element, fc_object, name):
         ET.SubElement(xml_element, name).text = getattr(fc_object, name)
 
+
+class BEMxml(BEMxmlWriter):
+    """BEMxml built in memory then written at once"""
+
     def write_to_file(self, full_path):
         self.tree.write(full_path, encoding="UTF-8", xml_declaration=True)
 
@@ -282,14 +342,100 @@ class BEMxml:
         return ET.tostring(self.root, encoding="unicode")
 
 
+class StreamingBEMxml(BEMxmlWriter):
+    """BEMxml written progressively to a text stream by a background writer thread.
+    write_header writes root, projects and zones. Each flush writes pending spaces to the stream and
+    pending boundaries to a temporary spool file. close writes spooled boundaries after spaces then
+    remaining sections. Writer queue is bounded so producer waits if writing is late. abort must be
+    called if close is not reached to stop writer thread and delete spool."""
+
+    def __init__(self, stream, model=None, queue_size: int = 64, geometry_store=None, geometry_sidecar=None):
+        super().__init__(model, geometry_store, geometry_sidecar)
+        self.stream = stream
+        self.spool = tempfile.TemporaryFile("w+", encoding="utf-8")
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.aborted = False
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def _write_loop(self):
+        while True:
+            task = self.queue.get()
+            if task is None:
+                return
+            if self.error or self.aborted:
+                continue
+            func, args = task
+            try:
+                func(*args)
+            except Exception as err:  # pylint: disable=broad-except
+                self.error = err
+
+    def _put(self, func, *args):
+        if self.error:
+            raise self.error
+        self.queue.put((func, args))
+
+    @staticmethod
+    def _write(target, value):
+        if not isinstance(value, str):
+            value = ET.tostring(value, encoding="unicode")
+        target.write(value)
+
+    def _copy_spool(self):
+        self.spool.seek(0)
+        shutil.copyfileobj(self.spool, self.stream)
+
+    def write_header(self):
+        attributes = "".join(f" {key}={quoteattr(value)}" for key, value in self.root.attrib.items())
+        self._put(self._write, self.stream, f"<?xml version='1.0' encoding='UTF-8'?>\n<bimbem{attributes}>")
+        self._put(self._write, self.stream, self.projects)
+        self._put(self._write, self.stream, self.zones)
+        self._put(self._write, self.stream, "<Spaces>")
+
+    def flush(self):
+        """Send spaces and boundaries written since last flush to the writer thread"""
+        for section, target in ((self.spaces, self.stream), (self.boundaries, self.spool)):
+            for xml_element in list(section):
+                self._put(self._write, target, xml_element)
+            del section[:]
+
+    def close(self):
+        self.flush()
+        self._put(self._write, self.stream, "</Spaces><Boundaries>")
+        self._put(self._copy_spool)
+        self._put(self._write, self.stream, "</Boundaries>")
+        for section in (self.building_element_types, self.building_elements, self.materials, self.shades):
+            self._put(self._write, self.stream, section)
+        self._put(self._write, self.stream, "</bimbem>")
+        self.queue.put(None)
+        self.writer.join()
+        self.spool.close()
+        if self.error:
+            raise self.error
+
+    def abort(self):
+        """Discard pending writes, stop writer thread and delete spool. Do nothing once closed."""
+        if self.writer.is_alive():
+            self.aborted = True
+            self.queue.put(None)
+            self.writer.join()
+        self.spool.close()
+
+
 def vector_to_dict(vector):
     """Convert a FreeCAD.Vector into a dict to write it as attribute in xml"""
     return {key: str(getattr(vector, key) / SCALE) for key in ("x", "y", "z")}
 
 
-def array_to_vector_dict(array):
-    """Convert a FreeCAD.Vector into a dict to write it as attribute in xml"""
-    return {key: str(value) for key, value in zip(("x", "y", "z"), array.tolist())}
+def format_points(points, decimals: int = None):
+    """Format a whole (n, 3) array at once. Values are rounded to decimals if given."""
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+    if decimals is not None:
+        # Adding 0.0 turns -0.0 produced by rounding into 0.0
+        points = np.round(points, decimals) + 0.0
+    return points.astype(str).tolist()
 
 
 def unitary_vector_to_dict(vector):
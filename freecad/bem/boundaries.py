@@ -11,31 +11,39 @@ Author : Cyril Waechter
 
 import itertools
 import os
-from collections import namedtuple
+from collections import defaultdict, namedtuple
 import typing
-from typing import NamedTuple, Iterable, List, Optional, Dict
+from typing import NamedTuple, Iterable, Iterator, List, Optional, Dict, Set
 
 import ifcopenshell
 import ifcopenshell.geom
 import ifcopenshell.util.element
 import ifcopenshell.util.unit
 
+import numpy as np
+
 import FreeCAD
 import FreeCADGui
 import Part
 
 from freecad.bem import materials
-from freecad.bem.bem_xml import BEMxml
+from freecad.bem.bem_xml import BEMxml, BEMxmlWriter, StreamingBEMxml
 from freecad.bem.bem_logging import logger, LOG_STREAM
 from freecad.bem.progress import Progress
 from freecad.bem import utils
+from freecad.bem import ids
 from freecad.bem.entities import (
     RelSpaceBoundary,
     BEMBoundary,
     Element,
     ElementType,
 )
-from freecad.bem.ifc_importer import IfcImporter, TOLERANCE
+from freecad.bem.ifc_importer import IfcImporter, TOLERANCE, is_shade
+from freecad.bem.watchdog import Watchdog, BudgetExceeded
+from freecad.bem.geometry_sidecar import GeometrySidecarWriter
+from freecad.bem.profiling import profile_stages
+from freecad.bem.memory import track_memory
+from freecad.bem.checkpoint import Checkpoint, IMPORTED, PREPARED, restore_progress
 
 if typing.TYPE_CHECKING:
     from freecad.bem.typing import (
@@ -44,26 +52,103 @@ if typing.TYPE_CHECKING:
     )  # pylint: disable=no-name-in-module, import-error
 
 
-def processing_sia_boundaries(doc=FreeCAD.ActiveDocument) -> None:
-    """Create SIA specific boundaries cf. https://www.sia.ch/fr/services/sia-norm/"""
+PIPELINE_TIERS = (
+    "preview",  # No boundary merging, rejoining nor ground check. Raw translated boundaries.
+    "standard",
+    "full",  # Standard pipeline followed by extra geometry checks
+)
+
+
+def check_tier(tier: str) -> None:
+    if tier not in PIPELINE_TIERS:
+        raise ValueError(f"Unknown pipeline tier <{tier}>. Valid tiers are {PIPELINE_TIERS}")
+
+
+def processing_sia_boundaries(doc=FreeCAD.ActiveDocument, tier: str = "standard") -> None:
+    """Create SIA specific boundaries cf. https://www.sia.ch/fr/services/sia-norm/
+    tier: one of PIPELINE_TIERS"""
+    prepare_sia_boundaries(doc, tier)
+    finalize_sia_boundaries(doc, tier)
+
+
+def prepare_sia_boundaries(doc=FreeCAD.ActiveDocument, tier: str = "standard") -> None:
+    """Complete and clean imported boundaries before SIA boundaries creation"""
+    for _ in iter_prepared_spaces(doc, tier):
+        pass
+    utils.purge_removed(doc)
+
+
+def iter_prepared_spaces(doc=FreeCAD.ActiveDocument, tier: str = "standard") -> Iterator["SpaceFeature"]:
+    """Prepare spaces one by one and yield each space once prepared. Removed objects are not purged."""
+    check_tier(tier)
+    is_preview = tier == "preview"
     Progress.set(30, "ProcessingSIABoundaries_Prepare", Progress.new_space_count(), 40)
+    ground = Ground.from_doc(doc) if not is_preview else None
+    for storey_spaces in group_by_container(utils.get_elements_by_ifctype("IfcSpace", doc)):
+        compute_spaces_area(storey_spaces)
     for space in utils.get_elements_by_ifctype("IfcSpace", doc):
-        ensure_hosted_element_are(space, doc)
-        ensure_hosted_are_coplanar(space)
-        compute_space_area(space)
-        set_face_to_boundary_info(space)
-        merge_over_splitted_boundaries(space, doc)
-        handle_curtain_walls(space, doc)
-        find_closest_edges(space)
-        set_leso_type(space)
-        ensure_external_earth_is_set(space, doc)
-        Progress.set()
+        Watchdog.start_space(space)
+        try:
+            ensure_hosted_element_are(space, doc)
+            ensure_hosted_are_coplanar(space)
+            set_face_to_boundary_info(space)
+            if not is_preview:
+                merge_over_splitted_boundaries(space)
+            handle_curtain_walls(space, doc)
+            if not is_preview:
+                find_closest_edges(space)
+            set_leso_type(space)
+            if not is_preview:
+                ensure_external_earth_is_set(space, ground)
+        finally:
+            Watchdog.end_space()
+        Progress.space_done()
+        yield space
+
+
+def finalize_sia_boundaries(doc=FreeCAD.ActiveDocument, tier: str = "standard") -> None:
+    """Create SIA boundaries from prepared boundaries"""
+    check_tier(tier)
     Progress.set(70, "ProcessingSIABoundaries_Create", Progress.new_space_count(), 20)
     ensure_materials_layers_order(doc)
-    create_sia_boundaries(doc)
+    create_sia_boundaries(doc, rejoin=tier != "preview")
+    if tier == "full":
+        check_sia_boundaries(doc)
     doc.recompute()
 
 
+def check_sia_boundaries(doc=FreeCAD.ActiveDocument) -> None:
+    """Extra checks of generated geometries. Issues are logged."""
+    for space in utils.get_elements_by_ifctype("IfcSpace", doc):
+        for boundary in space.SecondLevel.Group:
+            if boundary.IsHosted and not boundary.ParentBoundary:
+                logger.warning(f"Hosted boundary <{boundary.Id}> in space <{space.Id}> has no parent boundary")
+            for sia_type in SIA_TYPES:
+                sia_boundary = getattr(boundary, sia_type)
+                if not sia_boundary:
+                    continue
+                if not sia_boundary.Shape.isValid() or sia_boundary.Area.Value < TOLERANCE:
+                    logger.warning(f"Invalid {sia_type} geometry for boundary <{boundary.Id}> in space <{space.Id}>")
+        faces = [b.Shape.Faces[0] for b in space.SIA_Interiors.Group if b.Shape.Faces]
+        try:
+            shell = Part.Shell(faces)
+            shell.sewShape()
+            is_closed = shell.isClosed()
+        except Part.OCCError:
+            is_closed = False
+        if not is_closed:
+            logger.warning(f"SIA_Interior boundaries of space <{space.Id}> do not form a closed shell")
+
+
+def group_by_container(spaces) -> List[List["SpaceFeature"]]:
+    """Group spaces by their parent container (usually a storey)"""
+    containers = dict()
+    for space in spaces:
+        parent = space.getParentGroup()
+        containers.setdefault(getattr(parent, "Name", ""), []).append(space)
+    return list(containers.values())
+
+
 def reverse_layers(material):
     material.MaterialLayers = material.MaterialLayers[::-1]
     material.Thicknesses = material.Thicknesses[::-1]
@@ -119,35 +204,36 @@ def ensure_materials_layers_order(doc):
                         set_internal_to_external(occurence, material)
 
 
-def ensure_external_earth_is_set(space: "SpaceFeature", doc=FreeCAD.ActiveDocument):
-    sites: List["ContainerFeature"] = list(utils.get_elements_by_ifctype("IfcSite", doc))
-    ground_bound_box = get_ground_bound_box(sites)
-    if space.Shape.BoundBox.ZMin - ground_bound_box.ZMax > 1000:
+def ensure_external_earth_is_set(space: "SpaceFeature", ground: "Ground"):
+    if space.Shape.BoundBox.ZMin - ground.bound_box.ZMax > 1000:
         return
-    ground_shape = Part.Compound([])
-    for site in sites:
-        ground_shape.add(site.Shape)
-    if not ground_shape.BoundBox.isValid():
-        ground_shape = Part.Plane().toShape()
-    for boundary in space.SecondLevel.Group:
-        if boundary.InternalOrExternalBoundary in (
-            "INTERNAL",
-            "EXTERNAL_EARTH",
-            "EXTERNAL_WATER",
-            "EXTERNAL_FIRE",
-        ):
-            continue
-        if boundary.InnerBoundaries:
-            continue
-        if not is_underground(boundary, ground_shape):
+    boundaries = [
+        boundary
+        for boundary in utils.alive(space.SecondLevel.Group)
+        if boundary.InternalOrExternalBoundary not in ("INTERNAL", "EXTERNAL_EARTH", "EXTERNAL_WATER", "EXTERNAL_FIRE")
+        and not boundary.InnerBoundaries
+    ]
+    if not boundaries:
+        return
+    bound_boxes = [boundary.Shape.BoundBox for boundary in boundaries]
+    heights = ground.heights_at(np.array([(bbox.Center.x, bbox.Center.y) for bbox in bound_boxes]))
+    for boundary, bbox, height in zip(boundaries, bound_boxes, heights):
+        # Boundary far from ground line: vertical distance to ground is accurate enough
+        if height + GROUND_LINE_MARGIN < bbox.ZMin:
+            direction_z = bbox.ZMin - height
+        elif height - GROUND_LINE_MARGIN > bbox.ZMax:
+            direction_z = bbox.ZMax - height
+        # Boundary close to ground line or outside of ground triangulation
+        else:
+            direction_z = ground.distance_z(boundary)
+        if not is_underground(boundary, direction_z):
             continue
         boundary.InternalOrExternalBoundary = "EXTERNAL_EARTH"
 
 
-def is_underground(boundary, ground_shape) -> bool:
-    closest_points = ground_shape.distToShape(boundary.Shape)[1][0]
-    direction: FreeCAD.Vector = closest_points[1] - closest_points[0]
-    if direction.z > 1000:
+def is_underground(boundary, direction_z: float) -> bool:
+    """direction_z: vertical component of the shortest vector from ground to boundary"""
+    if direction_z > 1000:
         return False
     if boundary.LesoType == "Flooring":
         el_thickness = getattr(
@@ -155,16 +241,16 @@ def is_underground(boundary, ground_shape) -> bool:
             "Value",
             0,
         )
-        if direction.z - el_thickness * 1.5 > 0:
+        if direction_z - el_thickness * 1.5 > 0:
             return False
-        boundary.UndergroundDepth = abs(direction.z - el_thickness)
+        boundary.UndergroundDepth = abs(direction_z - el_thickness)
         return True
     if boundary.LesoType == "Wall":
         bbox = boundary.Shape.BoundBox
-        if (bbox.ZMax + bbox.ZMin) / 2 + direction.z < 0:
+        if (bbox.ZMax + bbox.ZMin) / 2 + direction_z < 0:
             return True
     if boundary.LesoType == "Ceiling":
-        if direction.z < TOLERANCE:
+        if direction_z < TOLERANCE:
             return True
     return False
 
@@ -176,6 +262,95 @@ def get_ground_bound_box(sites: Iterable["ContainerFeature"]) -> FreeCAD.BoundBo
     return boundbox if boundbox.isValid() else FreeCAD.BoundBox(0, 0, -30000, 0, 0, 0)
 
 
+GROUND_LINE_MARGIN = 1000  # Below this vertical distance to ground, exact OCC distance is used
+
+
+class Ground:
+    """Site ground surface, its bound box and a triangulated height field indexed once per document.
+    When no site has a shape, ground is considered as an horizontal plane at z = 0."""
+
+    def __init__(self, sites: List["ContainerFeature"]) -> None:
+        self.bound_box = get_ground_bound_box(sites)
+        shape = Part.Compound([])
+        for site in sites:
+            shape.add(site.Shape)
+        self.shape = shape if shape.BoundBox.isValid() else Part.Plane().toShape()
+        self.triangles = self.triangulate(shape) if shape.BoundBox.isValid() else None
+
+    @classmethod
+    def from_doc(cls, doc) -> "Ground":
+        return cls(list(utils.get_elements_by_ifctype("IfcSite", doc)))
+
+    @staticmethod
+    def triangulate(shape: Part.Shape) -> Optional[np.ndarray]:
+        """Return a (n, 3, 3) array of ground triangles"""
+        points, triangles = shape.tessellate(100)
+        if not triangles:
+            return None
+        return utils.vectors_to_array(points)[np.array(triangles)]
+
+    @property
+    def triangles(self) -> Optional[np.ndarray]:
+        return self._triangles
+
+    @triangles.setter
+    def triangles(self, triangles: Optional[np.ndarray]) -> None:
+        """Index triangles in a grid of about one triangle per cell by their xy bound box so that
+        only triangles around a point are tested"""
+        self._triangles = triangles
+        self.cells = defaultdict(list)
+        if triangles is None:
+            return
+        corners_xy = triangles[..., :2]
+        self.grid_origin = corners_xy.min(axis=(0, 1))
+        extent = corners_xy.max(axis=(0, 1)) - self.grid_origin
+        self.cell_size = max(extent.max() / np.sqrt(len(triangles)), TOLERANCE)
+        first_cells = self.cell_indices(corners_xy.min(axis=1))
+        last_cells = self.cell_indices(corners_xy.max(axis=1))
+        for index, ((x_first, y_first), (x_last, y_last)) in enumerate(zip(first_cells, last_cells)):
+            for cell in itertools.product(range(x_first, x_last + 1), range(y_first, y_last + 1)):
+                self.cells[cell].append(index)
+
+    def cell_indices(self, points_xy: np.ndarray) -> np.ndarray:
+        return np.floor((points_xy - self.grid_origin) / self.cell_size).astype(int)
+
+    def heights_at(self, points_xy: np.ndarray) -> np.ndarray:
+        """Ground height for each (x, y) point. nan when point is not above ground triangulation."""
+        if self.triangles is None:
+            return np.zeros(len(points_xy))
+        heights = np.full(len(points_xy), np.nan)
+        for index, (point_xy, cell) in enumerate(zip(points_xy, self.cell_indices(points_xy))):
+            candidates = self.cells.get(tuple(cell))
+            if candidates:
+                heights[index] = self.triangles_height(point_xy, self.triangles[candidates])
+        return heights
+
+    @staticmethod
+    def triangles_height(point_xy: np.ndarray, corners: np.ndarray) -> float:
+        """Highest height at (x, y) point of triangles containing it. nan if none contains it."""
+        origin = corners[:, 0, :2]
+        edge1 = corners[:, 1, :2] - origin
+        edge2 = corners[:, 2, :2] - origin
+        det = edge1[:, 0] * edge2[:, 1] - edge1[:, 1] * edge2[:, 0]
+        vertical = np.abs(det) < TOLERANCE
+        det[vertical] = 1
+        # Barycentric coordinates of point in each triangle
+        rel = point_xy - origin
+        coord1 = (rel[:, 0] * edge2[:, 1] - rel[:, 1] * edge2[:, 0]) / det
+        coord2 = (edge1[:, 0] * rel[:, 1] - edge1[:, 1] * rel[:, 0]) / det
+        inside = (coord1 >= -TOLERANCE) & (coord2 >= -TOLERANCE) & (coord1 + coord2 <= 1 + TOLERANCE) & ~vertical
+        if not inside.any():
+            return np.nan
+        z_origin = corners[:, 0, 2]
+        heights = z_origin + coord1 * (corners[:, 1, 2] - z_origin) + coord2 * (corners[:, 2, 2] - z_origin)
+        return heights[inside].max()
+
+    def distance_z(self, boundary) -> float:
+        """Vertical component of the shortest vector from ground to boundary using OCC"""
+        closest_points = self.shape.distToShape(boundary.Shape)[1][0]
+        return (closest_points[1] - closest_points[0]).z
+
+
 class FaceToBoundary:
     def __init__(self, boundary, face):
         self.boundary = boundary
@@ -183,7 +358,7 @@ class FaceToBoundary:
         self.point_on_face = None
         self.point_on_boundary = None
         self.compute_shortest()
-        self.boundary_normal = utils.get_boundary_normal(boundary, self.point_on_boundary)
+        self.boundary_normal = utils.get_boundary_normal(boundary)
         self.face_normal = utils.get_face_normal(face, self.point_on_face)
         self.distance = self.vec_to_space.Length
 
@@ -211,13 +386,66 @@ class FaceToBoundary:
         return self.face_normal * self.face_normal.dot(self.vec_to_space)
 
 
+class SpaceFaceMatcher:
+    """Find the closest parallel space face of boundaries.
+    Planes of space faces are precomputed so that only parallel faces are tested with OCC, closest
+    planes first. Distance from boundary polygon to face plane being a lower bound of face distance,
+    search stops as soon as it exceeds the best distance found."""
+
+    def __init__(self, faces) -> None:
+        self.faces = faces
+        self.planar_faces = [face for face in faces if isinstance(face.Surface, Part.Plane)]
+        self.other_faces = [face for face in faces if not isinstance(face.Surface, Part.Plane)]
+        self.normals = utils.vectors_to_array(utils.get_face_normal(face) for face in self.planar_faces)
+        points = utils.vectors_to_array(face.Vertexes[0].Point for face in self.planar_faces)
+        self.offsets = np.einsum("ij,ij->i", self.normals, points)
+
+    def match(self, boundaries) -> List[FaceToBoundary]:
+        normals = np.array(utils.update_boundaries_normals(boundaries))
+        dots = normals @ self.normals.T
+        plane_distances = [self.plane_distances(boundary) for boundary in boundaries]
+        return [
+            self.best_match(boundary, np.flatnonzero(np.abs(dots_row) > 1 - TOLERANCE), distances_row)
+            for boundary, dots_row, distances_row in zip(boundaries, dots, plane_distances)
+        ]
+
+    def plane_distances(self, boundary) -> np.ndarray:
+        """Distance from boundary polygon to each face plane: smallest vertex distance or 0 if
+        polygon crosses the plane. A single vertex is not a lower bound for nearly parallel faces."""
+        points = utils.vectors_to_array(vertex.Point for vertex in utils.get_outer_wire(boundary).Vertexes)
+        signed_distances = points @ self.normals.T - self.offsets
+        crossing = (signed_distances.min(axis=0) < 0) & (signed_distances.max(axis=0) > 0)
+        return np.where(crossing, 0, np.abs(signed_distances).min(axis=0))
+
+    def best_match(self, boundary, parallel_faces: np.ndarray, plane_distances: np.ndarray) -> FaceToBoundary:
+        best = None
+        for face_index in parallel_faces[np.argsort(plane_distances[parallel_faces])]:
+            if best and plane_distances[face_index] > best.distance + TOLERANCE:
+                break
+            best = self.closest_valid(best, FaceToBoundary(boundary, self.planar_faces[face_index]))
+        for face in self.other_faces:
+            best = self.closest_valid(best, FaceToBoundary(boundary, face))
+        if best:
+            return best
+        # No parallel face found. Fallback to an exhaustive search.
+        candidates = (FaceToBoundary(boundary, face) for face in self.faces)
+        return min(candidates, key=lambda x: x.distance if x.is_valid else 10000)
+
+    @staticmethod
+    def closest_valid(best: Optional[FaceToBoundary], candidate: FaceToBoundary) -> Optional[FaceToBoundary]:
+        if not candidate.is_valid:
+            return best
+        if best and best.distance <= candidate.distance:
+            return best
+        return candidate
+
+
 def set_face_to_boundary_info(space):
-    faces = space.Shape.Faces
-    for boundary in space.SecondLevel.Group:
-        if boundary.IsHosted:
-            continue
-        candidates = (FaceToBoundary(boundary, face) for face in faces)
-        result = min(candidates, key=lambda x: x.distance if x.is_valid else 10000)
+    boundaries = [boundary for boundary in space.SecondLevel.Group if not boundary.IsHosted]
+    if not boundaries:
+        return
+    matcher = SpaceFaceMatcher(space.Shape.Faces)
+    for boundary, result in zip(boundaries, matcher.match(boundaries)):
         boundary.TranslationToSpace = result.translation_to_face
         normal = result.fixed_normal
         boundary.Normal = normal
@@ -225,70 +453,138 @@ def set_face_to_boundary_info(space):
             hosted.Normal = normal
 
 
-def compute_space_area(space: Part.Feature):
-    """Compute both gross and net area"""
-    z_min = space.Shape.BoundBox.ZMin
-    z_sre = z_min + 1000  # 1 m above ground. See SIA 380:2015 &3.2.3 p.26-27
-    sre_plane = Part.Plane(FreeCAD.Vector(0, 0, z_sre), FreeCAD.Vector(0, 0, 1))
-    space.Area = space.Shape.common(sre_plane.toShape()).Area
-    # TODO: Not valid yet as it return net area. Find a way to get gross space volume
-    space.AreaAE = space.Area
+SpaceArea = namedtuple("SpaceArea", ["net", "gross"])
+
+
+def compute_spaces_area(spaces) -> None:
+    """Compute both gross and net area of a batch of spaces (typically all spaces of a storey)"""
+    for space in spaces:
+        z_sre = space.Shape.BoundBox.ZMin + 1000  # 1 m above ground. See SIA 380:2015 &3.2.3 p.26-27
+        area = prismatic_space_area(space.Shape) or sliced_space_area(space.Shape, z_sre)
+        space.Area = area.net
+        # TODO: Gross area still ignore walls thickness. Find a way to get gross space volume
+        space.AreaAE = area.gross
+
+
+def prismatic_space_area(shape: Part.Shape) -> Optional[SpaceArea]:
+    """Area of a space made of vertical faces, floor faces at its bottom and ceiling faces higher
+    than SRE plane. In this case SRE section is its floor. Return None for other spaces."""
+    z_sre = shape.BoundBox.ZMin + 1000
+    floors = []
+    for face in shape.Faces:
+        if not isinstance(face.Surface, Part.Plane):
+            return None
+        normal_z = utils.get_face_normal(face).z
+        if abs(normal_z) < TOLERANCE:
+            continue
+        if abs(normal_z) < 1 - TOLERANCE:
+            return None
+        if normal_z > 0:
+            if face.BoundBox.ZMin < z_sre:
+                return None
+            continue
+        if face.BoundBox.ZMax - shape.BoundBox.ZMin > TOLERANCE:
+            return None
+        floors.append(face)
+    if not floors:
+        return None
+    return SpaceArea(
+        net=sum(face.Area for face in floors),
+        gross=sum(Part.Face(face.OuterWire).Area for face in floors),
+    )
+
+
+def sliced_space_area(shape: Part.Shape, z_sre: float) -> SpaceArea:
+    """Area of the section of the space at z_sre using a plane section instead of a boolean"""
+    try:
+        wires = shape.slice(FreeCAD.Vector(0, 0, 1), z_sre)
+        section = Part.makeFace(wires, "Part::FaceMakerBullseye") if wires else None
+    except (Part.OCCError, RuntimeError):
+        section = None
+    if not section or not section.Faces:
+        sre_plane = Part.Plane(FreeCAD.Vector(0, 0, z_sre), FreeCAD.Vector(0, 0, 1))
+        section = shape.common(sre_plane.toShape())
+    return SpaceArea(
+        net=section.Area,
+        gross=sum(Part.Face(face.OuterWire).Area for face in section.Faces),
+    )
 
 
 def handle_curtain_walls(space, doc) -> None:
     """Add an hosted window with full area in curtain wall boundaries as they are not handled
     by BEM softwares"""
-    for boundary in space.SecondLevel.Group:
+    for boundary in utils.alive(space.SecondLevel.Group):
         if getattr(boundary.RelatedBuildingElement, "IfcType", "") != "IfcCurtainWall":
             continue
         # Prevent Revit issue which produce curtain wall with an hole inside but no inner boundary
         if not boundary.InnerBoundaries:
             if len(boundary.Shape.SubShapes) > 2:
                 outer_wire = boundary.Shape.SubShapes[1]
-                utils.generate_boundary_compound(boundary, outer_wire, ())
+                try:
+                    utils.generate_boundary_compound(boundary, outer_wire, ())
+                except BudgetExceeded as err:
+                    logger.warning(f"Hole of curtain wall boundary <{boundary.Id}> kept: {err}")
         boundary.LesoType = "Wall"
         fake_window = doc.copyObject(boundary)
+        # Host cannot be an empty face so inner wire is scaled down a little
+        inner_wire = utils.get_outer_wire(boundary).scale(0.999)
+        inner_wire = utils.project_wire_to_plane(inner_wire, utils.get_plane(boundary))
+        try:
+            utils.append_inner_wire(boundary, inner_wire)
+        except BudgetExceeded as err:
+            logger.warning(f"Curtain wall boundary <{boundary.Id}> kept without window: {err}")
+            utils.remove_later(fake_window)
+            continue
         fake_window.IsHosted = True
         fake_window.LesoType = "Window"
         fake_window.ParentBoundary = boundary
         fake_window.GlobalId = ifcopenshell.guid.new()
-        fake_window.Id = IfcId.new(doc)
+        fake_window.Id = ids.new_id(doc)
         RelSpaceBoundary.set_label(fake_window)
+        utils.register(fake_window)
         space.SecondLevel.addObject(fake_window)
-        # Host cannot be an empty face so inner wire is scaled down a little
-        inner_wire = utils.get_outer_wire(boundary).scale(0.999)
-        inner_wire = utils.project_wire_to_plane(inner_wire, utils.get_plane(boundary))
-        utils.append_inner_wire(boundary, inner_wire)
         utils.append(boundary, "InnerBoundaries", fake_window)
         if FreeCAD.GuiUp:
             fake_window.ViewObject.ShapeColor = (0.0, 0.7, 1.0)
 
 
-class IfcId:
-    """Generate new id for generated boundaries missing from ifc and keep track of last id used"""
-
-    current_id = 0
-
-    @classmethod
-    def new(cls, doc) -> int:
-        if not cls.current_id:
-            cls.current_id = max((getattr(obj, "Id", 0) for obj in doc.Objects))
-        cls.current_id += 1
-        return cls.current_id
+def write_xml(
+    doc=FreeCAD.ActiveDocument,
+    model=None,
+    tier: str = "standard",
+    geometry_store=None,
+    geometry_sidecar=None,
+    shades=None,
+    reference_geometry: bool = False,
+) -> BEMxml:
+    """Read BEM infos for FreeCAD file and write it to an xml.
+    xml is stored in an object to allow different outputs
+    geometry_store: optional GeometryStore to read polygons from instead of FreeCAD shapes
+    geometry_sidecar: optional GeometrySidecarWriter receiving polygons referenced by index in xml
+    shades: optional shades collected at import. See IfcImporter.collect_shades
+    reference_geometry: only reference polygons found in geometry_store. See BEMxml.write_stored_polygons"""
+    bem_xml = BEMxml(geometry_store=geometry_store, geometry_sidecar=geometry_sidecar)
+    bem_xml.reference_geometry = reference_geometry
+    write_xml_header(bem_xml, doc, model, tier)
+    for space in utils.get_elements_by_ifctype("IfcSpace", doc):
+        bem_xml.write_space(space)
+        for boundary in space.SecondLevel.Group:
+            bem_xml.write_boundary(boundary)
+    write_xml_elements(bem_xml, doc, model, shades)
+    return bem_xml
 
 
-def write_xml(doc=FreeCAD.ActiveDocument, model=None) -> BEMxml:
-    """Read BEM infos for FreeCAD file and write it to an xml.
-    xml is stored in an object to allow different outputs"""
-    bem_xml = BEMxml()
+def write_xml_header(bem_xml: BEMxmlWriter, doc, model, tier: str) -> None:
+    """Write processing tier, projects and zones"""
+    bem_xml.write_processing_tier(tier)
     for project in utils.get_elements_by_ifctype("IfcProject", doc):
         bem_xml.write_project(project)
     for zone in model.by_type("IfcZone"):
         bem_xml.write_zone(zone)
-    for space in utils.get_elements_by_ifctype("IfcSpace", doc):
-        bem_xml.write_space(space)
-        for boundary in space.SecondLevel.Group:
-            bem_xml.write_boundary(boundary)
+
+
+def write_xml_elements(bem_xml: BEMxmlWriter, doc, model, shades=None) -> None:
+    """Write building element types, building elements, materials and shades"""
     for building_element_type in utils.get_by_class(doc, ElementType):
         bem_xml.write_building_element_types(building_element_type)
     for building_element in utils.get_by_class(doc, Element):
@@ -303,9 +599,10 @@ def write_xml(doc=FreeCAD.ActiveDocument, model=None) -> BEMxml:
         ),
     ):
         bem_xml.write_material(material)
-    for shade in (e for e in model.by_type("IfcRelSpaceBoundary") if e.Name.lower().startswith("shade")):
-        bem_xml.write_shade(shade)
-    return bem_xml
+    if shades is None:
+        shades = ((e, None) for e in model.by_type("IfcRelSpaceBoundary") if is_shade(e))
+    for shade, vertices in shades:
+        bem_xml.write_shade(shade, vertices)
 
 
 def output_xml_to_path(bem_xml, xml_path=None):
@@ -347,12 +644,12 @@ def group_coplanar_boundaries(boundary_list) -> List[List["boundary"]]:
     return coplanar_boundaries
 
 
-def merge_over_splitted_boundaries(space, doc=FreeCAD.ActiveDocument):
+def merge_over_splitted_boundaries(space):
     """Try to merge oversplitted boundaries to reduce the number of boundaries and make sure that
     windows are not splitted as it is often with some authoring softwares like Revit.
     Why ? Less boundaries is more manageable, closer to what user expect and require
     less computational power"""
-    boundaries = space.SecondLevel.Group
+    boundaries = utils.alive(space.SecondLevel.Group)
     # Considered as the minimal size for an oversplit to occur (1 ceiling, 3 wall, 1 flooring)
     if len(boundaries) <= 5:
         return
@@ -363,17 +660,19 @@ def merge_over_splitted_boundaries(space, doc=FreeCAD.ActiveDocument):
         if boundary_list[0].IsHosted and len(boundary_list) != 1:
             coplanar_groups = group_coplanar_boundaries(boundary_list)
             for group in coplanar_groups:
-                merge_coplanar_boundaries(group, doc)
+                if is_space_budget_exceeded(space, "merging"):
+                    return
+                try:
+                    merge_coplanar_boundaries(group)
+                except BudgetExceeded:
+                    logger.warning(f"Hosted boundaries in space <{space.Id}> with key <{key}> kept unmerged")
 
     for key, boundary_list in elements_dict.items():
         # None coplanar boundaries should not be connected.
         # eg. round wall splitted with multiple orientations.
 
         # Case1: No oversplitted boundaries
-        try:
-            if boundary_list[0].IsHosted or len(boundary_list) == 1:
-                continue
-        except ReferenceError:
+        if utils.is_removed(boundary_list[0]) or boundary_list[0].IsHosted or len(boundary_list) == 1:
             continue
 
         coplanar_groups = group_coplanar_boundaries(boundary_list)
@@ -383,12 +682,24 @@ def merge_over_splitted_boundaries(space, doc=FreeCAD.ActiveDocument):
             if len(group) == 1:
                 continue
             # Case 2 : more than 1 boundary related to the same element might be grouped.
+            if is_space_budget_exceeded(space, "merging"):
+                return
             try:
-                merge_coplanar_boundaries(group, doc)
-            except Part.OCCError:
+                merge_coplanar_boundaries(group)
+            except (Part.OCCError, BudgetExceeded):
                 logger.warning(f"Cannot join boundaries in space <{space.Id}> with key <{key}>")
 
 
+def is_space_budget_exceeded(space, operation: str) -> bool:
+    """Log and return True if space time budget is exceeded. Remaining boundaries of the space are
+    then kept as they are"""
+    if not Watchdog.space_expired():
+        return False
+    Watchdog.mark_space()
+    logger.warning(f"Time budget exceeded for space <{space.Id}>. Remaining boundaries are not {operation}.")
+    return True
+
+
 def merged_wires(wire1: Part.Wire, wire2: Part.Wire) -> (Part.Wire, List[Part.Wire]):
     """Try to merge 2 wires meant using face merging algorithm.
     1. Transform wires into faces
@@ -414,15 +725,25 @@ def merge_boundaries(boundary1, boundary2) -> bool:
     wire1 = utils.get_outer_wire(boundary1)
     wire2 = utils.get_outer_wire(boundary2)
 
-    new_wire, extra_inner_wires = merged_wires(wire1, wire2)
+    try:
+        new_wire, extra_inner_wires = Watchdog.run(merged_wires, wire1, wire2)
+    except BudgetExceeded:
+        return False
     if not new_wire:
         return False
 
     # Update shape
+    hosts = {b.ParentBoundary.Name: b.ParentBoundary for b in (boundary1, boundary2) if b.IsHosted}
+    host_shapes = [(host, host.Shape.copy()) for host in hosts.values()]
     if boundary1.IsHosted:
         utils.remove_inner_wire(boundary1.ParentBoundary, wire1)
         utils.remove_inner_wire(boundary2.ParentBoundary, wire2)
-        utils.append_inner_wire(boundary1.ParentBoundary, new_wire)
+        try:
+            utils.append_inner_wire(boundary1.ParentBoundary, new_wire)
+        except BudgetExceeded as error:
+            logger.warning(f"Boundaries <{boundary1.Id}> and <{boundary2.Id}> not merged: {error}")
+            restore_shapes(host_shapes)
+            return False
     else:
         for inner_boundary in boundary2.InnerBoundaries:
             utils.append(boundary1, "InnerBoundaries", inner_boundary)
@@ -435,6 +756,7 @@ def merge_boundaries(boundary1, boundary2) -> bool:
         utils.generate_boundary_compound(boundary1, new_wire, inner_wires)
     except RuntimeError as error:
         logger.exception(error)
+        restore_shapes(host_shapes)
         return False
     RelSpaceBoundary.recompute_areas(boundary1)
 
@@ -452,7 +774,7 @@ def merge_corresponding_boundaries(boundary1, boundary2):
         corresponding_boundary.CorrespondingBoundary = boundary1
 
 
-def merge_coplanar_boundaries(boundaries: list, doc=FreeCAD.ActiveDocument):
+def merge_coplanar_boundaries(boundaries: list):
     """Try to merge coplanar boundaries"""
     if len(boundaries) == 1:
         return
@@ -462,15 +784,17 @@ def merge_coplanar_boundaries(boundaries: list, doc=FreeCAD.ActiveDocument):
     for boundary in boundaries:
         utils.project_boundary_onto_plane(boundary, plane)
     boundaries.remove(boundary1)
-    remove_from_doc = list()
 
     # Attempt to merge boundaries
     while True and boundaries:
+        if Watchdog.space_expired():
+            break
         for boundary2 in boundaries:
             if merge_boundaries(boundary1, boundary2):
                 merge_corresponding_boundaries(boundary1, boundary2)
                 boundaries.remove(boundary2)
-                remove_from_doc.append(boundary2)
+                # Removed from FreeCAD document at the end of the stage
+                utils.remove_later(boundary2)
                 break
         else:
             logger.warning(
@@ -479,9 +803,11 @@ def merge_coplanar_boundaries(boundaries: list, doc=FreeCAD.ActiveDocument):
             )
             break
 
-    # Clean FreeCAD document if join operation was a success
-    for fc_object in remove_from_doc:
-        doc.removeObject(fc_object.Name)
+
+def restore_shapes(shapes) -> None:
+    """Restore (object, shape) saved before a failed operation"""
+    for fc_object, shape in shapes:
+        fc_object.Shape = shape
 
 
 def create_fake_host(boundary, space, doc):
@@ -489,18 +815,23 @@ def create_fake_host(boundary, space, doc):
     fake_host.IsHosted = False
     fake_host.LesoType = "Wall"
     fake_host.GlobalId = ifcopenshell.guid.new()
-    fake_host.Id = IfcId.new(doc)
+    fake_host.Id = ids.new_id(doc)
     RelSpaceBoundary.set_label(fake_host)
+    utils.register(fake_host)
     space.SecondLevel.addObject(fake_host)
     inner_wire = utils.get_outer_wire(boundary)
     outer_wire = inner_wire.scaled(1.001, inner_wire.CenterOfMass)
     plane = utils.get_plane(boundary)
     outer_wire = utils.project_wire_to_plane(outer_wire, plane)
     inner_wire = utils.project_wire_to_plane(inner_wire, plane)
-    utils.generate_boundary_compound(fake_host, outer_wire, [inner_wire])
+    try:
+        utils.generate_boundary_compound(fake_host, outer_wire, [inner_wire])
+    except BudgetExceeded as err:
+        logger.warning(f"Fake host <{fake_host.Id}> kept without hole: {err}")
     boundary.ParentBoundary = fake_host
     fake_building_element = doc.copyObject(boundary.RelatedBuildingElement)
-    fake_building_element.Id = IfcId.new(doc)
+    fake_building_element.Id = ids.new_id(doc)
+    utils.register(fake_building_element)
     fake_host.RelatedBuildingElement = fake_building_element
     utils.append(fake_host, "InnerBoundaries", boundary)
     if FreeCAD.GuiUp:
@@ -651,7 +982,7 @@ def find_closest_by_intersection(boundary1, boundary2):
 
 def find_closest_edges(space: "SpaceFeature") -> None:
     """Find closest boundary and edge to be able to reconstruct a closed shell"""
-    boundaries = [b for b in space.SecondLevel.Group if not b.IsHosted]
+    boundaries = [b for b in utils.alive(space.SecondLevel.Group) if not b.IsHosted]
     init_closest_default_values(boundaries)
 
     # Loop through all boundaries and edges to find the closest edge
@@ -677,7 +1008,7 @@ def find_closest_edges(space: "SpaceFeature") -> None:
 
 
 def set_leso_type(space):
-    for boundary in space.SecondLevel.Group:
+    for boundary in utils.alive(space.SecondLevel.Group):
         # LesoType is defined in previous steps for curtain walls
         if boundary.LesoType != "Unknown":
             continue
@@ -729,42 +1060,71 @@ def is_low_angle(edge1, edge2):
         return False
 
 
-def create_sia_boundaries(doc=FreeCAD.ActiveDocument):
+def create_sia_boundaries(doc=FreeCAD.ActiveDocument, rejoin: bool = True):
     """Create boundaries necessary for SIA calculations"""
     for space in utils.get_elements_by_ifctype("IfcSpace", doc):
+        create_space_sia_boundaries(space, rejoin)
+        Progress.space_done()
+
+
+def create_space_sia_boundaries(space, rejoin: bool = True):
+    Watchdog.start_space(space)
+    try:
         create_sia_ext_boundaries(space)
         create_sia_int_boundaries(space)
-        rejoin_boundaries(space, "SIA_Exterior")
-        rejoin_boundaries(space, "SIA_Interior")
-        Progress.set()
+        if rejoin:
+            rejoin_boundaries(space)
+    finally:
+        Watchdog.end_space()
 
 
-def get_intersecting_line(boundary1, boundary2) -> Optional[Part.Line]:
-    plane_intersect = utils.get_plane(boundary1).intersectSS(utils.get_plane(boundary2))
+SIA_TYPES = ("SIA_Exterior", "SIA_Interior")
+
+SiaGeometry = namedtuple("SiaGeometry", ["boundary", "plane", "lines", "bound_box"])
+
+
+def build_rejoin_table(space) -> Dict[str, Dict[int, SiaGeometry]]:
+    """Precompute for each SIA type: base boundary id → SIA boundary, its plane and its edges lines"""
+    table: Dict[str, Dict[int, SiaGeometry]] = {sia_type: dict() for sia_type in SIA_TYPES}
+    for base_boundary in space.SecondLevel.Group:
+        for sia_type in SIA_TYPES:
+            boundary = getattr(base_boundary, sia_type)
+            if not boundary:
+                continue
+            lines = [utils.line_from_edge(edge) for edge in utils.get_outer_wire(boundary).Edges]
+            # bound_box used to make sure line solution is in a reallistic scope (distance <= 5 m)
+            bound_box = boundary.Shape.BoundBox
+            bound_box.enlarge(5000)
+            table[sia_type][base_boundary.Id] = SiaGeometry(boundary, utils.get_plane(boundary), lines, bound_box)
+    return table
+
+
+def get_intersecting_line(plane1: Part.Plane, plane2: Part.Plane) -> Optional[Part.Line]:
+    plane_intersect = plane1.intersectSS(plane2)
     return plane_intersect[0] if plane_intersect else None
 
 
-def get_medial_axis(boundary1, boundary2, ei1, ei2) -> Optional[Part.Line]:
-    line1 = utils.line_from_edge(utils.get_outer_wire(boundary1).Edges[ei1])
+def get_medial_axis(geo1: SiaGeometry, geo2: SiaGeometry, ei1: int, ei2: int) -> Optional[Part.Line]:
+    line1 = geo1.lines[ei1]
     try:
-        line2 = utils.line_from_edge(utils.get_outer_wire(boundary2).Edges[ei2])
+        line2 = geo2.lines[ei2]
     except IndexError:
         logger.warning(
-            f"""Cannot find closest edge index <{ei2}> in boundary <{boundary2.Label}>
-            to rejoin boundary <{boundary1.Label}>"""
+            f"""Cannot find closest edge index <{ei2}> in boundary <{geo2.boundary.Label}>
+            to rejoin boundary <{geo1.boundary.Label}>"""
         )
         return None
 
-    # Case 2a : edges are not parallel
+    # Case 2a : edges are not parallel
     if abs(line1.Direction.dot(line2.Direction)) < 1 - TOLERANCE:
-        b1_plane = utils.get_plane(boundary1)
-        line_intersect = line1.intersect2d(line2, b1_plane)
-        if line_intersect:
-            point1 = b1_plane.value(*line_intersect[0])
-            if line1.Direction.dot(line2.Direction) > 0:
-                point2 = point1 + line1.Direction + line2.Direction
-            else:
-                point2 = point1 + line1.Direction - line2.Direction
+        line_intersect = line1.intersect2d(line2, geo1.plane)
+        if not line_intersect:
+            return None
+        point1 = geo1.plane.value(*line_intersect[0])
+        if line1.Direction.dot(line2.Direction) > 0:
+            point2 = point1 + line1.Direction + line2.Direction
+        else:
+            point2 = point1 + line1.Direction - line2.Direction
     # Case 2b : edges are parallel
     else:
         point1 = (line1.Location + line2.Location) * 0.5
@@ -773,7 +1133,9 @@ def get_medial_axis(boundary1, boundary2, ei1, ei2) -> Optional[Part.Line]:
     try:
         return Part.Line(point1, point2)
     except Part.OCCError:
-        logger.exception(f"Failure in boundary id <{boundary1.SourceBoundary.Id}> {point1} and {point2} are equal")
+        logger.exception(
+            f"Failure in boundary id <{geo1.boundary.SourceBoundary.Id}> {point1} and {point2} are equal"
+        )
         return None
 
 
@@ -782,85 +1144,88 @@ def is_valid_join(line, fallback_line):
     return abs(line.Direction.dot(fallback_line.Direction)) > 0.96
 
 
-def rejoin_boundaries(space, sia_type):
+def rejoin_boundaries(space):
     """
-    Rejoin boundaries after their translation to get a correct close shell surfaces.
+    Rejoin SIA_Interior and SIA_Exterior boundaries after their translation to get a correct close
+    shell surfaces.
     1 Fill gaps between boundaries (2b)
     2 Fill gaps gerenate by translation to make a boundary on the inside or outside boundary of
     building elements
+    Joins are computed from geometries precomputed before any boundary is modified.
     https://standards.buildingsmart.org/IFC/RELEASE/IFC4/ADD2_TC1/HTML/schema/ifcproductextension/lexical/ifcrelspaceboundary2ndlevel.htm # pylint: disable=line-too-long
     """
-    base_boundaries = space.SecondLevel.Group
-    for base_boundary in base_boundaries:
-        boundary1 = getattr(base_boundary, sia_type)
-        if not boundary1:
-            continue
-        lines = []
-        fallback_lines = [utils.line_from_edge(edge) for edge in utils.get_outer_wire(boundary1).Edges]
-
-        # bound_box used to make sure line solution is in a reallistic scope (distance <= 5 m)
-        bound_box = boundary1.Shape.BoundBox
-        bound_box.enlarge(5000)
-
+    table = build_rejoin_table(space)
+    for base_boundary in space.SecondLevel.Group:
+        if is_space_budget_exceeded(space, "rejoining"):
+            return
         if (
             base_boundary.IsHosted
             or base_boundary.PhysicalOrVirtualBoundary == "VIRTUAL"
             or not base_boundary.RelatedBuildingElement
         ):
             continue
-
-        b1_plane = utils.get_plane(boundary1)
-        for b2_id, (ei1, ei2), fallback_line in zip(
-            base_boundary.ClosestBoundaries,
-            enumerate(base_boundary.ClosestEdges),
-            fallback_lines,
-        ):
-            base_boundary2 = utils.get_in_list_by_id(base_boundaries, b2_id)
-            boundary2 = getattr(base_boundary2, sia_type, None)
-            if not boundary2:
-                logger.warning(f"Cannot find corresponding boundary with id <{b2_id}>")
-                lines.append(fallback_line)
-                continue
-            # Case 1 : boundaries are not parallel
-            line = get_intersecting_line(boundary1, boundary2)
-            if line:
-                if not is_valid_join(line, fallback_line):
-                    line = fallback_line
-                if not bound_box.intersect(line.Location, line.Direction):
-                    line = fallback_line
-                lines.append(line)
-                continue
-            # Case 2 : boundaries are parallel
-            line = get_medial_axis(boundary1, boundary2, ei1, ei2)
-            if line and is_valid_join(line, fallback_line):
-                lines.append(line)
-                continue
-
+        for sia_geometries in table.values():
+            geo1 = sia_geometries.get(base_boundary.Id)
+            if geo1:
+                rejoin_boundary(base_boundary, geo1, sia_geometries)
+
+
+def rejoin_boundary(base_boundary, geo1: SiaGeometry, sia_geometries: Dict[int, SiaGeometry]) -> None:
+    lines = []
+    intersecting_lines: Dict[int, Optional[Part.Line]] = dict()
+    for b2_id, (ei1, ei2), fallback_line in zip(
+        base_boundary.ClosestBoundaries,
+        enumerate(base_boundary.ClosestEdges),
+        geo1.lines,
+    ):
+        geo2 = sia_geometries.get(b2_id)
+        if not geo2:
+            logger.warning(f"Cannot find corresponding boundary with id <{b2_id}>")
             lines.append(fallback_line)
-
-        # Generate new shape
-        try:
-            outer_wire = utils.polygon_from_lines(lines, b1_plane)
-        except (Part.OCCError, utils.ShapeCreationError):
-            logger.exception(f"Invalid geometry while rejoining boundary Id <{base_boundary.Id}>")
             continue
-        try:
-            Part.Face(outer_wire)
-        except Part.OCCError:
-            logger.exception(f"Unable to rejoin boundary Id <{base_boundary.Id}>")
+        # Case 1 : boundaries are not parallel
+        if b2_id not in intersecting_lines:
+            intersecting_lines[b2_id] = get_intersecting_line(geo1.plane, geo2.plane)
+        line = intersecting_lines[b2_id]
+        if line:
+            if not is_valid_join(line, fallback_line):
+                line = fallback_line
+            if not geo1.bound_box.intersect(line.Location, line.Direction):
+                line = fallback_line
+            lines.append(line)
             continue
-
-        inner_wires = utils.get_inner_wires(boundary1)
-        try:
-            utils.generate_boundary_compound(boundary1, outer_wire, inner_wires)
-        except RuntimeError as err:
-            logger.exception(err)
+        # Case 2 : boundaries are parallel
+        line = get_medial_axis(geo1, geo2, ei1, ei2)
+        if line and is_valid_join(line, fallback_line):
+            lines.append(line)
             continue
 
-        boundary1.Area = area = boundary1.Shape.Area
-        for inner_boundary in base_boundary.InnerBoundaries:
-            area = area + inner_boundary.Shape.Area
-        boundary1.AreaWithHosted = area
+        lines.append(fallback_line)
+
+    # Generate new shape
+    boundary1 = geo1.boundary
+    try:
+        outer_wire = utils.polygon_from_lines(lines, geo1.plane)
+    except (Part.OCCError, utils.ShapeCreationError):
+        logger.exception(f"Invalid geometry while rejoining boundary Id <{base_boundary.Id}>")
+        return
+    try:
+        Part.Face(outer_wire)
+    except Part.OCCError:
+        logger.exception(f"Unable to rejoin boundary Id <{base_boundary.Id}>")
+        return
+
+    inner_wires = utils.get_inner_wires(boundary1)
+    try:
+        utils.generate_boundary_compound(boundary1, outer_wire, inner_wires)
+    except RuntimeError as err:
+        logger.exception(err)
+        return
+
+    boundary1.Area = area = boundary1.Shape.Area
+    for inner_boundary in base_boundary.InnerBoundaries:
+        area = area + inner_boundary.Shape.Area
+    boundary1.AreaWithHosted = area
 
 
 def create_sia_ext_boundaries(space):
@@ -912,30 +1277,155 @@ class XmlResult(NamedTuple):
     log: str
 
 
-def generate_bem_xml_from_file(ifc_path: str) -> XmlResult:
+def generate_bem_xml_from_file(
+    ifc_path: str,
+    tier: str = "standard",
+    space_timeout: float = None,
+    operation_timeout: float = None,
+    checkpoint_dir: str = None,
+    geometry_path: str = None,
+    profile_dir: str = None,
+    memory_dir: str = None,
+) -> XmlResult:
+    """tier: one of PIPELINE_TIERS. "preview" is fast but lower quality, "full" adds extra checks
+    space_timeout, operation_timeout: optional time budgets in seconds. See Watchdog.
+    checkpoint_dir: optional directory where pipeline state is saved after import and preparation.
+    A rerun with same ifc_path and checkpoint_dir resume from last completed stage.
+    geometry_path: optional path of a binary file receiving polygons. See geometry_sidecar.
+    profile_dir: optional directory receiving per stage profiling results. See profiling.
+    memory_dir: optional directory receiving per stage memory report. See memory."""
+    check_tier(tier)
+    Watchdog.configure(space_timeout, operation_timeout)
     try:
         import pyCaller
 
         Progress.progress_func = pyCaller.SetProgress
     except ImportError:
         pass
-    Progress.set(0, "IfcImport_OpenIfcFile", "")
-    ifc_importer = IfcImporter(ifc_path)
-    ifc_importer.generate_rel_space_boundaries()
-    doc = ifc_importer.doc
-    processing_sia_boundaries(doc)
-    Progress.set(90, "Communicate_Write", "")
-    xml_str = write_xml(doc, ifc_importer.ifc_file).tostring()
+    with profile_stages(profile_dir), track_memory(memory_dir):
+        Progress.set(0, "IfcImport_OpenIfcFile", "")
+        checkpoint = Checkpoint(checkpoint_dir, ifc_path, tier) if checkpoint_dir else None
+        stage, doc = checkpoint.resume() if checkpoint else (None, None)
+        ifc_importer = IfcImporter(ifc_path, doc)
+        try:
+            doc = ifc_importer.doc
+            if stage is None:
+                ifc_importer.generate_rel_space_boundaries()
+                if checkpoint:
+                    checkpoint.save(doc, IMPORTED)
+            else:
+                restore_progress(doc, ifc_importer.ifc_file)
+                ifc_importer.collect_shades()
+            if stage != PREPARED:
+                prepare_sia_boundaries(doc, tier)
+                if checkpoint:
+                    checkpoint.save(doc, PREPARED)
+            finalize_sia_boundaries(doc, tier)
+            Progress.set(90, "Communicate_Write", "")
+            sidecar = GeometrySidecarWriter() if geometry_path else None
+            bem_xml = write_xml(doc, ifc_importer.ifc_file, tier, geometry_sidecar=sidecar, shades=ifc_importer.shades)
+            if sidecar:
+                bem_xml.write_geometry_file(os.path.basename(geometry_path))
+                sidecar.write(geometry_path)
+            xml_str = bem_xml.tostring()
+        finally:
+            ids.unregister(ifc_importer.doc)
+    Watchdog.stop()
+    if checkpoint:
+        checkpoint.clear()
     log_str = LOG_STREAM.getvalue()
     Progress.set(100, "Communicate_Send", "")
     return XmlResult(xml_str, log_str)
 
 
-def process_test_file(ifc_path, doc):
+def space_neighbours(doc) -> Dict[str, Set[str]]:
+    """Names of spaces linked to each space through corresponding boundaries"""
+    spaces = list(utils.get_elements_by_ifctype("IfcSpace", doc))
+    neighbours: Dict[str, Set[str]] = {space.Name: set() for space in spaces}
+    for space in spaces:
+        for boundary in utils.alive(space.SecondLevel.Group):
+            other_space = getattr(boundary.CorrespondingBoundary, "RelatingSpace", None)
+            if other_space and other_space.Name != space.Name and other_space.Name in neighbours:
+                neighbours[space.Name].add(other_space.Name)
+                neighbours[other_space.Name].add(space.Name)
+    return neighbours
+
+
+def stream_bem_xml_from_file(
+    ifc_path: str,
+    xml_path: str,
+    tier: str = "standard",
+    queue_size: int = 64,
+    geometry_path: str = None,
+    profile_dir: str = None,
+    memory_dir: str = None,
+) -> str:
+    """Pipelined variant of generate_bem_xml_from_file writing xml to xml_path while processing.
+    Preparation may merge boundaries of neighbour spaces so a space SIA boundaries are created and
+    the space is written as soon as it and all its neighbours are prepared. Boundaries are written
+    once layers order, which depends on every boundary of an element, is known. Return log."""
+    check_tier(tier)
+    output_dir = os.path.dirname(os.path.abspath(xml_path))
+    with profile_stages(profile_dir, output_dir), track_memory(memory_dir, output_dir):
+        Progress.set(0, "IfcImport_OpenIfcFile", "")
+        ifc_importer = IfcImporter(ifc_path)
+        try:
+            ifc_importer.generate_rel_space_boundaries()
+            doc = ifc_importer.doc
+            model = ifc_importer.ifc_file
+            neighbours = space_neighbours(doc)
+            prepared: Set[str] = set()
+            written: Dict[str, "SpaceFeature"] = {}
+            with open(xml_path, "w", encoding="utf-8") as stream:
+                sidecar = GeometrySidecarWriter() if geometry_path else None
+                bem_xml = StreamingBEMxml(stream, model, queue_size, geometry_sidecar=sidecar)
+                try:
+                    if sidecar:
+                        bem_xml.write_geometry_file(os.path.basename(geometry_path))
+                    write_xml_header(bem_xml, doc, model, tier)
+                    bem_xml.write_header()
+                    for space in iter_prepared_spaces(doc, tier):
+                        prepared.add(space.Name)
+                        candidates = (doc.getObject(name) for name in (space.Name, *neighbours[space.Name]))
+                        ready = [
+                            c
+                            for c in candidates
+                            if c.Name in prepared and c.Name not in written and neighbours[c.Name] <= prepared
+                        ]
+                        if ready:
+                            utils.purge_removed(doc)
+                        for ready_space in ready:
+                            create_space_sia_boundaries(ready_space, rejoin=tier != "preview")
+                            bem_xml.write_space(ready_space)
+                            bem_xml.flush()
+                            written[ready_space.Name] = ready_space
+                    Progress.set(70, "ProcessingSIABoundaries_Create", Progress.new_space_count(), 20)
+                    ensure_materials_layers_order(doc)
+                    if tier == "full":
+                        check_sia_boundaries(doc)
+                    doc.recompute()
+                    Progress.set(90, "Communicate_Write", "")
+                    for space in written.values():
+                        for boundary in space.SecondLevel.Group:
+                            bem_xml.write_boundary(boundary)
+                        bem_xml.flush()
+                    write_xml_elements(bem_xml, doc, model, ifc_importer.shades)
+                    bem_xml.close()
+                finally:
+                    bem_xml.abort()
+            if sidecar:
+                sidecar.write(geometry_path)
+        finally:
+            ids.unregister(ifc_importer.doc)
+    Progress.set(100, "Communicate_Send", "")
+    return LOG_STREAM.getvalue()
+
+
+def process_test_file(ifc_path, doc, tier: str = "standard"):
     ifc_importer = IfcImporter(ifc_path, doc)
     ifc_importer.generate_rel_space_boundaries()
-    processing_sia_boundaries(doc)
-    bem_xml = write_xml(doc, ifc_importer.ifc_file)
+    processing_sia_boundaries(doc, tier)
+    bem_xml = write_xml(doc, ifc_importer.ifc_file, tier, shades=ifc_importer.shades)
     output_xml_to_path(bem_xml)
     ifc_importer.xml = bem_xml
     ifc_importer.log = LOG_STREAM.getvalue()
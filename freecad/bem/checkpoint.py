@@ -0,0 +1,104 @@
+# coding: utf8
+"""This module save and restore pipeline state between stages to allow resuming a failed run.
+
+© All rights reserved.
+ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland, Laboratory CNPA, 2019-2020
+
+See the LICENSE.TXT file for more details.
+
+Author : Cyril Waechter
+"""
+import os
+from typing import Optional, Tuple
+
+import FreeCAD
+
+from freecad.bem import utils
+from freecad.bem.bem_logging import logger
+from freecad.bem.progress import Progress
+
+IMPORTED = "imported"
+PREPARED = "prepared"
+STAGES = (IMPORTED, PREPARED)
+
+META_STAGE = "BIMxBEM_Stage"
+META_TIER = "BIMxBEM_Tier"
+META_SOURCE = "BIMxBEM_Source"
+META_SIGNATURE = "BIMxBEM_SourceSignature"
+
+
+def source_signature(ifc_path: str) -> str:
+    """Size and modification time of source file to detect a modified source"""
+    stat = os.stat(ifc_path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def restore_progress(doc, ifc_file) -> None:
+    """Progress counters are normally computed during import which is skipped on resume"""
+    Progress.count_elements(ifc_file)
+    Progress.len_spaces = sum(1 for _ in utils.get_elements_by_ifctype("IfcSpace", doc)) or 1
+
+
+class Checkpoint:
+    """FreeCAD document saved as FCStd after each completed stage. Stage, tier and source file are
+    recorded in document Meta so a checkpoint is only reused for the same source and tier."""
+
+    def __init__(self, directory: str, ifc_path: str, tier: str) -> None:
+        self.directory = directory
+        self.ifc_path = os.path.abspath(ifc_path)
+        self.tier = tier
+        self.name = os.path.splitext(os.path.basename(ifc_path))[0]
+
+    def path(self, stage: str) -> str:
+        return os.path.join(self.directory, f"{self.name}.{stage}.FCStd")
+
+    def save(self, doc, stage: str) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        meta = doc.Meta
+        meta.update(
+            {
+                META_STAGE: stage,
+                META_TIER: self.tier,
+                META_SOURCE: self.ifc_path,
+                META_SIGNATURE: source_signature(self.ifc_path),
+            }
+        )
+        doc.Meta = meta
+        doc.saveAs(self.path(stage))
+        logger.info(f"Checkpoint <{stage}> saved to {self.path(stage)}")
+
+    def is_valid(self, doc, stage: str) -> bool:
+        meta = doc.Meta
+        if meta.get(META_STAGE) != stage or meta.get(META_SOURCE) != self.ifc_path:
+            return False
+        if meta.get(META_SIGNATURE) != source_signature(self.ifc_path):
+            return False
+        # Import does not depend on tier. Preparation does.
+        return stage == IMPORTED or meta.get(META_TIER) == self.tier
+
+    def resume(self) -> Tuple[Optional[str], Optional["FreeCAD.Document"]]:
+        """Return last completed stage and its document or (None, None) if nothing can be resumed"""
+        for stage in reversed(STAGES):
+            path = self.path(stage)
+            if not os.path.exists(path):
+                continue
+            try:
+                doc = FreeCAD.openDocument(path)
+            except (OSError, RuntimeError) as err:
+                logger.warning(f"Unable to open checkpoint {path}: {err}")
+                continue
+            if self.is_valid(doc, stage):
+                FreeCAD.setActiveDocument(doc.Name)
+                logger.info(f"Resuming from checkpoint <{stage}> {path}")
+                return stage, doc
+            logger.info(f"Checkpoint {path} does not match source or tier. Ignored.")
+            FreeCAD.closeDocument(doc.Name)
+        return None, None
+
+    def clear(self) -> None:
+        """Remove checkpoints once pipeline completed"""
+        for stage in STAGES:
+            try:
+                os.remove(self.path(stage))
+            except FileNotFoundError:
+                continue
@@ -15,7 +15,6 @@ from typing import Iterable
 import ifcopenshell
 
 import FreeCAD
-import Part
 
 from freecad.bem.bem_logging import logger
 from freecad.bem import utils
@@ -56,19 +55,22 @@ def get_color(ifc_boundary):
     return (0.0, 0.0, 0.0)
 
 
-def get_related_element(ifc_entity, doc=FreeCAD.ActiveDocument) -> Part.Feature:
-    if not ifc_entity.RelatedBuildingElement:
-        return
-    guid = ifc_entity.RelatedBuildingElement.GlobalId
-    for element in doc.Objects:
-        try:
-            if element.GlobalId == guid:
-                return element
-        except AttributeError:
-            continue
+class ProxyState:
+    """Python proxies only persist their Type when document is saved. Other attributes (ifc_importer,
+    ifc_entity, caches…) are transient and cannot be restored from a saved document."""
+
+    def __getstate__(self):
+        return {"Type": self.Type}
+
+    def __setstate__(self, state):
+        self.Type = state["Type"]  # pylint: disable=invalid-name
+
+    # FreeCAD ⩾0.21 use dumps/loads instead of __getstate__/__setstate__
+    dumps = __getstate__
+    loads = __setstate__
 
 
-class Root:
+class Root(ProxyState):
     """Wrapping various IFC entity :
     https://standards.buildingsmart.org/IFC/RELEASE/IFC4_1/FINAL/HTML/link/ifcroot.htm
     """
@@ -94,6 +96,7 @@ class Root:
         obj = FreeCAD.ActiveDocument.addObject("Part::FeaturePython", cls.__name__)
         cls(obj)
         cls._init_properties(obj)
+        utils.register(obj)
 
         if FreeCAD.GuiUp:
             obj.ViewObject.Proxy = ViewProviderRoot(obj.ViewObject)
@@ -106,6 +109,7 @@ class Root:
         obj.Proxy.ifc_importer = ifc_importer
         cls.read_from_ifc(obj, ifc_entity)
         cls.set_label(obj)
+        utils.register(obj)
         return obj
 
     @classmethod
@@ -135,6 +139,15 @@ class ViewProviderRoot:
         vobj.Proxy = self
         vobj.addExtension("Gui::ViewProviderGroupExtensionPython")
 
+    def __getstate__(self):
+        return None
+
+    def __setstate__(self, state):
+        pass
+
+    dumps = __getstate__
+    loads = __setstate__
+
 
 class RelSpaceBoundary(Root):
     """Wrapping IFC entity :
@@ -202,7 +215,7 @@ class RelSpaceBoundary(Root):
     def read_from_ifc(cls, obj: "RelSpaceBoundaryFeature", ifc_entity) -> None:
         super().read_from_ifc(obj, ifc_entity)
         ifc_importer = obj.Proxy.ifc_importer
-        element = get_related_element(ifc_entity, ifc_importer.doc)
+        element = ifc_importer.fc_element(ifc_entity.RelatedBuildingElement)
         if element:
             obj.RelatedBuildingElement = element
             utils.append(element, "ProvidesBoundaries", obj)
@@ -211,11 +224,11 @@ class RelSpaceBoundary(Root):
         try:
             obj.Shape = ifc_importer.create_fc_shape(ifc_entity)
         except utils.ShapeCreationError:
-            ifc_importer.doc.removeObject(obj.Name)
+            utils.remove_later(obj)
             raise utils.ShapeCreationError
         obj.Area = obj.AreaWithHosted = obj.Shape.Area
         if obj.Area < utils.TOLERANCE:
-            ifc_importer.doc.removeObject(obj.Name)
+            utils.remove_later(obj)
             raise utils.IsTooSmall
         try:
             obj.IsHosted = bool(ifc_entity.RelatedBuildingElement.FillsVoids)
@@ -231,6 +244,8 @@ class RelSpaceBoundary(Root):
     def onChanged(self, obj: "RelSpaceBoundaryFeature", prop):  # pylint: disable=invalid-name
         if prop == "InnerBoundaries":
             self.recompute_area_with_hosted(obj)
+        elif prop in ("Shape", "Placement"):
+            self.newell_normal = None
 
     @classmethod
     def recompute_areas(cls, obj: "RelSpaceBoundaryFeature") -> None:
@@ -279,7 +294,7 @@ class Element(Root):
     def create_from_ifc(cls, ifc_entity, ifc_importer: "IfcImporter") -> "ElementFeature":
         """Stantard FreeCAD FeaturePython Object creation method"""
         obj = super().create_from_ifc(ifc_entity, ifc_importer)
-        ifc_importer.create_element_type(obj, ifcopenshell.util.element.get_type(ifc_entity))
+        ifc_importer.create_element_type(obj, ifc_importer.graph.element_type(ifc_entity))
         ifc_importer.material_creator.create(obj, ifc_entity)
         obj.Thickness = ifc_importer.guess_thickness(obj, ifc_entity)
 
@@ -359,7 +374,7 @@ class ElementType(Root):
         )
 
 
-class BEMBoundary:
+class BEMBoundary(ProxyState):
     def __init__(self, obj: "BEMBoundaryFeature", boundary: "RelSpaceBoundaryFeature") -> None:
         self.Type = "BEMBoundary"  # pylint: disable=invalid-name
         obj.Proxy = self
@@ -373,11 +388,16 @@ class BEMBoundary:
         obj.Area = boundary.Area
         obj.AreaWithHosted = boundary.AreaWithHosted
 
+    def onChanged(self, obj: "BEMBoundaryFeature", prop):  # pylint: disable=invalid-name
+        if prop in ("Shape", "Placement"):
+            self.newell_normal = None
+
     @staticmethod
     def create(boundary: "RelSpaceBoundaryFeature", geo_type) -> "BEMBoundaryFeature":
         """Stantard FreeCAD FeaturePython Object creation method"""
         obj = FreeCAD.ActiveDocument.addObject("Part::FeaturePython", "BEMBoundary")
         BEMBoundary(obj, boundary)
+        utils.register(obj)
         setattr(boundary, geo_type, obj)
         if FreeCAD.GuiUp:
             # ViewProviderRelSpaceBoundary(obj.ViewObject)
@@ -0,0 +1,73 @@
+# coding: utf8
+"""This module write polygons to a binary file referenced by index from bimbem xml instead of
+writing each point as xml text.
+
+File layout (little endian):
+    header: magic b"BEMGEO1\\0" (8 bytes), vertex count, ring count, polygon count (uint64 each)
+    vertices: vertex count * (x, y, z) float64 in metres
+    ring offsets: (ring count + 1) int64, ring i is vertices[ring_offsets[i]:ring_offsets[i + 1]]
+    polygon offsets: (polygon count + 1) int64, polygon j rings are ring offsets
+        polygon_offsets[j] to polygon_offsets[j + 1]. First ring of a polygon is its outer ring.
+Polygon index is the one written in xml <geom index="j"/>.
+
+© All rights reserved.
+ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland, Laboratory CNPA, 2019-2020
+
+See the LICENSE.TXT file for more details.
+
+Author : Cyril Waechter
+"""
+import struct
+from typing import List
+
+import numpy as np
+
+from freecad.bem.geometry_store import polygon_rings
+
+MAGIC = b"BEMGEO1\0"
+HEADER = struct.Struct("<8sQQQ")
+
+
+class GeometrySidecarWriter:
+    """Collect polygons while xml is written then write them at once"""
+
+    def __init__(self) -> None:
+        self.rings: List[np.ndarray] = []
+        self.ring_counts: List[int] = []
+
+    def add(self, rings: List[np.ndarray]) -> int:
+        """Add a polygon given as (n, 3) arrays and return its index"""
+        self.rings.extend(np.asarray(ring, dtype="<f8").reshape(-1, 3) for ring in rings)
+        self.ring_counts.append(len(rings))
+        return len(self.ring_counts) - 1
+
+    def write(self, path: str) -> None:
+        vertices = np.vstack(self.rings) if self.rings else np.empty((0, 3), dtype="<f8")
+        ring_offsets = np.concatenate(([0], np.cumsum([len(ring) for ring in self.rings]))).astype("<i8")
+        polygon_offsets = np.concatenate(([0], np.cumsum(self.ring_counts))).astype("<i8")
+        with open(path, "wb") as sidecar:
+            sidecar.write(HEADER.pack(MAGIC, len(vertices), len(self.rings), len(self.ring_counts)))
+            for array in (vertices, ring_offsets, polygon_offsets):
+                sidecar.write(np.ascontiguousarray(array).tobytes())
+
+
+class GeometrySidecar:
+    """Memory mapped read access to a geometry sidecar file"""
+
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as sidecar:
+            magic, nb_vertices, nb_rings, nb_polygons = HEADER.unpack(sidecar.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a bimbem geometry file")
+        offset = HEADER.size
+        self.vertices = np.memmap(path, dtype="<f8", mode="r", offset=offset, shape=(nb_vertices, 3))
+        offset += self.vertices.nbytes
+        self.ring_offsets = np.memmap(path, dtype="<i8", mode="r", offset=offset, shape=(nb_rings + 1,))
+        offset += self.ring_offsets.nbytes
+        self.polygon_offsets = np.memmap(path, dtype="<i8", mode="r", offset=offset, shape=(nb_polygons + 1,))
+
+    def __len__(self) -> int:
+        return len(self.polygon_offsets) - 1
+
+    def rings(self, index: int) -> List[np.ndarray]:
+        return polygon_rings(self.vertices, self.ring_offsets, self.polygon_offsets, index)
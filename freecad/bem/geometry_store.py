@@ -0,0 +1,163 @@
+# coding: utf8
+"""This module store boundary polygons in flat numpy arrays which can be shared between processes
+without copy.
+
+© All rights reserved.
+ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland, Laboratory CNPA, 2019-2020
+
+See the LICENSE.TXT file for more details.
+
+Author : Cyril Waechter
+"""
+from multiprocessing import shared_memory
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from freecad.bem import utils
+
+# Polygon kinds: boundary itself or one of its SIA geometries
+KINDS = ("Boundary", "SIA_Interior", "SIA_Exterior")
+
+
+def polygon_rings(vertices, ring_offsets, polygon_offsets, index: int) -> List[np.ndarray]:
+    """Rings of polygon at index as views on vertices array"""
+    first, last = polygon_offsets[index : index + 2]
+    offsets = ring_offsets[first : last + 1]
+    return [vertices[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+class SharedArray(NamedTuple):
+    """Picklable reference to an array stored in shared memory"""
+
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+class GeometryStore:
+    """Columnar storage of polygons:
+    vertices: (n, 3) float64 points of all rings
+    ring_offsets: (r + 1) int64, ring i is vertices[ring_offsets[i]:ring_offsets[i + 1]]
+    polygon_offsets: (p + 1) int64, polygon j rings are ring_offsets[polygon_offsets[j]:polygon_offsets[j + 1]]
+    ids: (p) int64 boundary id of each polygon
+    kinds: (p) int8 index in KINDS
+    normals: (p, 3) float64 unit normal of each polygon
+    First ring of a polygon is its outer ring."""
+
+    arrays = ("vertices", "ring_offsets", "polygon_offsets", "ids", "kinds", "normals")
+
+    def __init__(self, vertices, ring_offsets, polygon_offsets, ids, kinds, normals) -> None:
+        self.vertices = vertices
+        self.ring_offsets = ring_offsets
+        self.polygon_offsets = polygon_offsets
+        self.ids = ids
+        self.kinds = kinds
+        self.normals = normals
+        self.shared_memories: List[shared_memory.SharedMemory] = []
+        self._index: Optional[Dict[Tuple[int, int], int]] = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def from_polygons(cls, polygons: Iterable[Tuple[int, str, List[np.ndarray], Iterable[float]]]):
+        """polygons: (boundary id, kind, rings as (n, 3) arrays, normal)"""
+        rings: List[np.ndarray] = []
+        ring_counts, ids, kinds, normals = [], [], [], []
+        for boundary_id, kind, polygon_rings, normal in polygons:
+            rings.extend(polygon_rings)
+            ring_counts.append(len(polygon_rings))
+            ids.append(boundary_id)
+            kinds.append(KINDS.index(kind))
+            normals.append(tuple(normal))
+        ring_sizes = [len(ring) for ring in rings]
+        return cls(
+            vertices=np.vstack(rings).astype(np.float64) if rings else np.empty((0, 3)),
+            ring_offsets=np.concatenate(([0], np.cumsum(ring_sizes, dtype=np.int64))),
+            polygon_offsets=np.concatenate(([0], np.cumsum(ring_counts, dtype=np.int64))),
+            ids=np.array(ids, dtype=np.int64),
+            kinds=np.array(kinds, dtype=np.int8),
+            normals=np.array(normals, dtype=np.float64).reshape(-1, 3),
+        )
+
+    @classmethod
+    def from_boundaries(cls, boundaries, include_sia: bool = True) -> "GeometryStore":
+        """Fill store from RelSpaceBoundary features and optionally their SIA geometries"""
+        return cls.from_polygons(cls._iter_polygons(boundaries, include_sia))
+
+    @staticmethod
+    def _iter_polygons(boundaries, include_sia: bool):
+        for boundary in boundaries:
+            geometries = [(KINDS[0], boundary)]
+            if include_sia:
+                geometries.extend((kind, getattr(boundary, kind, None)) for kind in KINDS[1:])
+            for kind, fc_object in geometries:
+                if not fc_object:
+                    continue
+                rings = [
+                    utils.vectors_to_array(vertex.Point for vertex in wire.Vertexes)
+                    for wire in utils.get_wires(fc_object)
+                ]
+                if not rings:
+                    continue
+                yield boundary.Id, kind, rings, utils.get_boundary_normal(fc_object)
+
+    def index(self, boundary_id: int, kind: str = "Boundary") -> Optional[int]:
+        if self._index is None:
+            self._index = {key: i for i, key in enumerate(zip(self.ids.tolist(), self.kinds.tolist()))}
+        return self._index.get((boundary_id, KINDS.index(kind)))
+
+    def rings(self, index: int) -> List[np.ndarray]:
+        """Rings of polygon at index as views on vertices array"""
+        return polygon_rings(self.vertices, self.ring_offsets, self.polygon_offsets, index)
+
+    def share(self) -> "GeometryStore":
+        """Copy arrays to shared memory. Returned store must be closed then unlinked by its owner."""
+        arrays, memories = [], []
+        for name in self.arrays:
+            array = getattr(self, name)
+            memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            shared = np.ndarray(array.shape, dtype=array.dtype, buffer=memory.buf)
+            shared[...] = array
+            arrays.append(shared)
+            memories.append(memory)
+        store = GeometryStore(*arrays)
+        store.shared_memories = memories
+        return store
+
+    def descriptor(self) -> Dict[str, SharedArray]:
+        """Picklable description sent to workers to attach to a shared store"""
+        if not self.shared_memories:
+            raise ValueError("Store is not in shared memory. Use share() first.")
+        return {
+            name: SharedArray(memory.name, getattr(self, name).shape, getattr(self, name).dtype.str)
+            for name, memory in zip(self.arrays, self.shared_memories)
+        }
+
+    @classmethod
+    def attach(cls, descriptor: Dict[str, SharedArray]) -> "GeometryStore":
+        """Zero-copy access to a store shared by another process"""
+        arrays, memories = [], []
+        for name in cls.arrays:
+            shared_array = descriptor[name]
+            memory = shared_memory.SharedMemory(name=shared_array.name)
+            arrays.append(np.ndarray(shared_array.shape, dtype=np.dtype(shared_array.dtype), buffer=memory.buf))
+            memories.append(memory)
+        store = cls(*arrays)
+        store.shared_memories = memories
+        return store
+
+    def close(self) -> None:
+        """Detach from shared memory. Views previously returned by rings() must not be used anymore."""
+        self._index = None
+        for name in self.arrays:
+            setattr(self, name, None)
+        for memory in self.shared_memories:
+            memory.close()
+
+    def unlink(self) -> None:
+        """Release shared memory. Only owner process should call it once every process closed it."""
+        for memory in self.shared_memories:
+            memory.unlink()
+        self.shared_memories = []
@@ -0,0 +1,82 @@
+# coding: utf8
+"""This module allocate ids of generated entities (fake hosts, fake windows…) missing from ifc.
+
+© All rights reserved.
+ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland, Laboratory CNPA, 2019-2020
+
+See the LICENSE.TXT file for more details.
+
+Author : Cyril Waechter
+"""
+import threading
+from typing import Dict
+
+# Allocator of each document by document name. See register.
+_ALLOCATORS: Dict[str, "IdAllocator"] = {}
+_ALLOCATORS_LOCK = threading.Lock()
+
+
+def max_ifc_id(ifc_file) -> int:
+    get_max_id = getattr(getattr(ifc_file, "wrapped_data", None), "getMaxId", None)
+    if get_max_id:
+        return get_max_id()
+    return max((entity.id() for entity in ifc_file), default=0)
+
+
+def max_doc_id(doc) -> int:
+    return max((getattr(obj, "Id", 0) for obj in doc.Objects), default=0)
+
+
+class IdAllocator:
+    """Hand out ids greater than every id of source ifc file. Thread safe."""
+
+    def __init__(self, last_id: int = 0) -> None:
+        self.last_id = last_id
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_ifc(cls, ifc_file, doc=None) -> "IdAllocator":
+        """Seed from ifc file and, for a document restored from a previous run, from ids it already
+        contains"""
+        last_id = max_ifc_id(ifc_file)
+        if doc is not None:
+            last_id = max(last_id, max_doc_id(doc))
+        return cls(last_id)
+
+    def new(self) -> int:
+        with self.lock:
+            self.last_id += 1
+            return self.last_id
+
+    def allocate_block(self, size: int) -> int:
+        """Reserve size consecutive ids eg. for a worker process. Return last id before the block
+        so IdAllocator(returned value) allocates within the block."""
+        with self.lock:
+            block_start = self.last_id
+            self.last_id += size
+            return block_start
+
+
+def register(doc, allocator: IdAllocator) -> IdAllocator:
+    with _ALLOCATORS_LOCK:
+        _ALLOCATORS[doc.Name] = allocator
+    return allocator
+
+
+def unregister(doc) -> None:
+    with _ALLOCATORS_LOCK:
+        _ALLOCATORS.pop(doc.Name, None)
+
+
+def get_allocator(doc) -> IdAllocator:
+    """Allocator registered at import. Documents not created by IfcImporter (eg. opened FCStd) get one
+    seeded from their content on first use."""
+    with _ALLOCATORS_LOCK:
+        allocator = _ALLOCATORS.get(doc.Name)
+        if allocator is None:
+            allocator = _ALLOCATORS[doc.Name] = IdAllocator(max_doc_id(doc))
+        return allocator
+
+
+def new_id(doc) -> int:
+    return get_allocator(doc).new()
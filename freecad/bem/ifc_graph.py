@@ -0,0 +1,77 @@
+# coding: utf8
+"""This module extract once the IFC relationships used during import to query them in constant time.
+
+© All rights reserved.
+ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland, Laboratory CNPA, 2019-2020
+
+See the LICENSE.TXT file for more details.
+
+Author : Cyril Waechter
+"""
+from typing import Dict, List, Optional, Set
+
+from ifcopenshell import entity_instance
+
+
+class IfcGraph:
+    """Relationships by entity id:
+    element → type, element → associated materials, opening → host, filling element → opening,
+    element → boundaries it provides.
+    Also lists IfcRelSpaceBoundary, IfcElement providing boundaries to imported spaces and
+    boundaries with a parent or a corresponding boundary."""
+
+    def __init__(self, ifc_file, space_ids: Optional[Set[int]] = None) -> None:
+        self.space_ids = space_ids
+        self.types: Dict[int, entity_instance] = {}
+        self.materials: Dict[int, List[entity_instance]] = {}
+        self.opening_hosts: Dict[int, entity_instance] = {}
+        self.filled_openings: Dict[int, entity_instance] = {}
+        self.provided_boundaries: Dict[int, List[entity_instance]] = {}
+        self.boundaries: List[entity_instance] = []
+        self.with_parent: List[entity_instance] = []
+        self.with_corresponding: List[entity_instance] = []
+        self.elements: List[entity_instance] = []
+        self._read_relationships(ifc_file)
+
+    def _read_relationships(self, ifc_file) -> None:
+        for rel in ifc_file.by_type("IfcRelDefinesByType"):
+            for ifc_object in rel.RelatedObjects:
+                self.types[ifc_object.id()] = rel.RelatingType
+        for rel in ifc_file.by_type("IfcRelAssociatesMaterial"):
+            for ifc_object in rel.RelatedObjects:
+                self.materials.setdefault(ifc_object.id(), []).append(rel.RelatingMaterial)
+        for rel in ifc_file.by_type("IfcRelVoidsElement"):
+            self.opening_hosts.setdefault(rel.RelatedOpeningElement.id(), rel.RelatingBuildingElement)
+        for rel in ifc_file.by_type("IfcRelFillsElement"):
+            self.filled_openings.setdefault(rel.RelatedBuildingElement.id(), rel.RelatingOpeningElement)
+        for boundary in ifc_file.by_type("IfcRelSpaceBoundary"):
+            self.boundaries.append(boundary)
+            if not self.is_imported(boundary):
+                continue
+            if boundary.RelatedBuildingElement:
+                self.provided_boundaries.setdefault(boundary.RelatedBuildingElement.id(), []).append(boundary)
+            # ParentBoundary and CorrespondingBoundary do not exist in IFC2x3
+            if not boundary.is_a("IfcRelSpaceBoundary2ndLevel"):
+                continue
+            if boundary.ParentBoundary:
+                self.with_parent.append(boundary)
+            if boundary.CorrespondingBoundary:
+                self.with_corresponding.append(boundary)
+        self.elements = [e for e in ifc_file.by_type("IfcElement") if e.id() in self.provided_boundaries]
+
+    def is_imported(self, boundary) -> bool:
+        return self.space_ids is None or boundary.RelatingSpace.id() in self.space_ids
+
+    def element_type(self, ifc_entity):
+        """Same as ifcopenshell.util.element.get_type"""
+        if ifc_entity.is_a("IfcTypeObject"):
+            return ifc_entity
+        return self.types.get(ifc_entity.id())
+
+    def associated_materials(self, ifc_entity) -> List[entity_instance]:
+        return self.materials.get(ifc_entity.id(), [])
+
+    def host(self, ifc_element):
+        """Element in which ifc_element fills a void eg. wall of a window"""
+        opening = self.filled_openings.get(ifc_element.id())
+        return self.opening_hosts.get(opening.id()) if opening else None
@@ -9,7 +9,7 @@ See the LICENSE.TXT file for more details.
 Author : Cyril Waechter
 """
 
-from typing import Generator
+from typing import Optional
 
 import ifcopenshell
 import ifcopenshell.geom
@@ -25,8 +25,13 @@ import Part
 
 from freecad.bem import materials
 from freecad.bem import utils
+from freecad.bem import ids
+from freecad.bem.ids import IdAllocator
 from freecad.bem.bem_logging import logger
+from freecad.bem.geometry_store import GeometryStore
+from freecad.bem.ifc_graph import IfcGraph
 from freecad.bem.progress import Progress
+from freecad.bem.watchdog import BudgetExceeded
 from freecad.bem.entities import (
     RelSpaceBoundary,
     Element,
@@ -40,41 +45,15 @@ from freecad.bem.entities import (
 TOLERANCE = 0.001
 
 
-def get_by_class(doc=FreeCAD.ActiveDocument, by_class=object):
-    """Generator throught FreeCAD document element of specific python proxy class"""
-    for element in doc.Objects:
-        try:
-            if isinstance(element.Proxy, by_class):
-                yield element
-        except AttributeError:
-            continue
-
-
-def get_elements_by_ifctype(ifc_type: str, doc=FreeCAD.ActiveDocument) -> Generator[Part.Feature, None, None]:
-    """Generator throught FreeCAD document element of specific ifc_type"""
-    for element in doc.Objects:
-        try:
-            if element.IfcType == ifc_type:
-                yield element
-        except (AttributeError, ReferenceError):
-            continue
-
-
-def get_materials(doc=FreeCAD.ActiveDocument):
-    """Generator throught FreeCAD document element of specific python proxy class"""
-    for element in doc.Objects:
-        try:
-            if element.IfcType in (
-                "IfcMaterial",
-                "IfcMaterialList",
-                "IfcMaterialLayerSet",
-                "IfcMaterialLayerSetUsage",
-                "IfcMaterialConstituentSet",
-                "IfcMaterialConstituent",
-            ):
-                yield element
-        except AttributeError:
-            continue
+# Material entities imported as FreeCAD objects
+MATERIAL_IFC_TYPES = (
+    "IfcMaterial",
+    "IfcMaterialList",
+    "IfcMaterialLayerSet",
+    "IfcMaterialLayerSetUsage",
+    "IfcMaterialConstituentSet",
+    "IfcMaterialConstituent",
+)
 
 
 def is_second_level(boundary):
@@ -82,17 +61,29 @@ def is_second_level(boundary):
 
 
 class IfcImporter:
-    def __init__(self, ifc_path, doc=None):
+    def __init__(self, ifc_path, doc=None, space_ids=None, id_allocator: IdAllocator = None):
+        """space_ids: optionally restrict import to these IfcSpace ids and their bounding elements
+        id_allocator: optional allocator of generated entities ids. Seeded from ifc file by default."""
+        existing_doc = doc
         if not doc:
             doc = FreeCAD.newDocument()
         self.doc = doc
+        # Document name may be reused from a closed document
+        utils.forget_registry(doc)
+        self.space_ids = set(space_ids) if space_ids is not None else None
         self.ifc_file = ifcopenshell.open(ifc_path)
+        self.id_allocator = ids.register(doc, id_allocator or IdAllocator.from_ifc(self.ifc_file, existing_doc))
+        self.graph = IfcGraph(self.ifc_file, self.space_ids)
         self.ifc_scale = ifcopenshell.util.unit.calculate_unit_scale(self.ifc_file)
         self.fc_scale = FreeCAD.Units.Metre.Value
         self.total_scale = self.fc_scale * self.ifc_scale
         self.element_types = dict()
+        # FreeCAD elements by GlobalId
+        self.fc_elements = dict()
         self.material_creator = materials.MaterialCreator(self)
         self.xml: str = ""
+        # (IfcRelSpaceBoundary, (n, 3) vertices in metres) of shading surfaces. See collect_shades.
+        self.shades = []
         self.log: str = ""
         self.settings = ifcopenshell.geom.settings()
         self.settings_brep_curve = self.load_brep_curve_settings()
@@ -110,14 +101,16 @@ class IfcImporter:
         elements_group = get_or_create_group("Elements", doc)
         element_types_group = get_or_create_group("ElementTypes", doc)
         ifc_types = set()
-        for ifc_entity in (e for e in ifc_file.by_type("IfcElement") if e.ProvidesBoundaries):
-            elements_group.addObject(Element.create_from_ifc(ifc_entity, self))
-            ifc_type = ifcopenshell.util.element.get_type(ifc_entity)
+        for ifc_entity in self.boundary_elements():
+            fc_element = Element.create_from_ifc(ifc_entity, self)
+            self.fc_elements[ifc_entity.GlobalId] = fc_element
+            elements_group.addObject(fc_element)
+            ifc_type = self.graph.element_type(ifc_entity)
             if ifc_type not in ifc_types and ifc_type is not None:
                 ifc_types.add(ifc_type)
                 element_types_group.addObject(Element.create_from_ifc(ifc_type, self))
         materials_group = get_or_create_group("Materials", doc)
-        for material in get_materials(doc):
+        for material in utils.get_elements_by_ifctypes(MATERIAL_IFC_TYPES, doc):
             materials_group.addObject(material)
         # Generate projects structure and boundaries
         Progress.set(5, "IfcImport_StructureAndBoundaries", "")
@@ -126,20 +119,20 @@ class IfcImporter:
             self.generate_containers(ifc_project, project)
 
         # Associate existing ParentBoundary and CorrespondingBoundary
-        associate_parent_and_corresponding(ifc_file, doc)
+        associate_parent_and_corresponding(self.graph, doc)
 
         Progress.set(15, "IfcImporter_EnrichingDatas", "")
         # Associate CorrespondingBoundary
         associate_corresponding_boundaries(doc)
 
         # Associate Host / Hosted elements
-        associate_host_element(ifc_file, elements_group)
+        associate_host_element(self.graph, self.fc_elements)
 
         # Associate hosted elements
         i = 0
-        for i, fc_space in enumerate(get_elements_by_ifctype("IfcSpace", doc), 1):
+        for i, fc_space in enumerate(utils.get_elements_by_ifctype("IfcSpace", doc), 1):
             Progress.set(15, "IfcImporter_EnrichingDatas", f"{i}")
-            fc_boundaries = fc_space.SecondLevel.Group
+            fc_boundaries = utils.alive(fc_space.SecondLevel.Group)
             # Minimal number of boundary is 5: 3 vertical faces, 2 horizontal faces
             # If there is less than 5 boundaries there is an issue or a new case to analyse
             if len(fc_boundaries) == 5:
@@ -148,8 +141,67 @@ class IfcImporter:
                 assert ValueError, f"{fc_space.Label} has less than 5 boundaries"
 
             # Associate hosted elements
-            associate_inner_boundaries(fc_boundaries, doc)
+            associate_inner_boundaries(fc_boundaries)
         Progress.len_spaces = i
+        utils.purge_removed(doc)
+        self.collect_shades()
+
+    def collect_shades(self):
+        """Shading surfaces are IfcRelSpaceBoundary named shade… Their outline is computed once at
+        import and written later from cached vertices."""
+        self.shades = [
+            (ifc_boundary, self.shade_vertices(ifc_boundary))
+            for ifc_boundary in self.graph.boundaries
+            if is_shade(ifc_boundary)
+        ]
+
+    def shade_vertices(self, ifc_boundary) -> np.ndarray:
+        """Outline of plane polygonal surfaces is computed directly. Other surfaces are tessellated."""
+        surface = ifc_boundary.ConnectionGeometry.SurfaceOnRelatingElement
+        points = None
+        if surface.is_a("IfcCurveBoundedPlane"):
+            points = self.outline_points(surface.OuterBoundary)
+        if points is None:
+            shape = ifcopenshell.geom.create_shape(self.settings, surface)
+            return ifcopenshell.util.shape.get_vertices(shape)
+        matrix = ifcopenshell.util.placement.get_axis2placement(surface.BasisSurface.Position)
+        return (points @ matrix[:3, :3].T + matrix[:3, 3]) * self.ifc_scale
+
+    def outline_points(self, curve) -> Optional[np.ndarray]:
+        """(n, 3) points of a polyline like curve without closing point. None if curve is not supported."""
+        if curve.is_a("IfcCompositeCurve") and len(curve.Segments) == 1:
+            curve = curve.Segments[0].ParentCurve
+        if curve.is_a("IfcPolyline"):
+            points = self.points_by_polyline(curve)
+        elif curve.is_a("IfcIndexedPolyCurve") and not curve.Segments:
+            points = np.array(curve.Points.CoordList)
+        else:
+            return None
+        if len(points) > 1 and np.array_equal(points[0], points[-1]):
+            points = points[:-1]
+        if points.shape[1] == 2:
+            points = np.c_[points, np.zeros(len(points))]
+        return points
+
+    def geometry_store(self, include_sia: bool = True, shared: bool = False) -> GeometryStore:
+        """Columnar copy of imported boundaries geometry. With shared=True arrays are in shared memory
+        and can be attached from other processes with GeometryStore.attach(store.descriptor())"""
+        boundaries = utils.get_elements_by_ifctype("IfcRelSpaceBoundary", self.doc)
+        store = GeometryStore.from_boundaries(boundaries, include_sia)
+        return store.share() if shared else store
+
+    def is_imported_space(self, ifc_space) -> bool:
+        return self.space_ids is None or ifc_space.id() in self.space_ids
+
+    def boundary_elements(self):
+        """IfcElement providing boundaries to imported spaces"""
+        return self.graph.elements
+
+    def fc_element(self, ifc_element):
+        """FreeCAD element created from ifc_element if any"""
+        if not ifc_element:
+            return None
+        return self.fc_elements.get(ifc_element.GlobalId)
 
     def guess_thickness(self, obj, ifc_entity):
         if obj.Material:
@@ -225,7 +277,7 @@ class IfcImporter:
         for rel_aggregates in ifc_parent.IsDecomposedBy:
             for element in rel_aggregates.RelatedObjects:
                 if element.is_a("IfcSpace"):
-                    if element.BoundedBy:
+                    if element.BoundedBy and self.is_imported_space(element):
                         self.generate_space(element, fc_parent)
                         self.generate_containers(element, fc_parent)
                 else:
@@ -244,7 +296,7 @@ class IfcImporter:
         fc_location.scale(*[self.ifc_scale * self.fc_scale] * 3)
         if not fc_location.Length > 1000000:  # 1 km
             return
-        for project in get_by_class(self.doc, Project):
+        for project in utils.get_by_class(self.doc, Project):
             project.WorldCoordinateSystem += fc_location
         ifc_location.Coordinates = (
             0.0,
@@ -416,19 +468,26 @@ class IfcImporter:
         return settings
 
 
-def associate_host_element(ifc_file, elements_group):
-    # Associate Host / Hosted elements
-    ifc_elements = (e for e in ifc_file.by_type("IfcElement") if e.ProvidesBoundaries)
-    for ifc_entity in ifc_elements:
-        if ifc_entity.FillsVoids:
-            try:
-                host = utils.get_element_by_guid(utils.get_host_guid(ifc_entity), elements_group)
-            except LookupError as err:
-                logger.exception(err)
-                continue
-            hosted = utils.get_element_by_guid(ifc_entity.GlobalId, elements_group)
-            utils.append(host, "HostedElements", hosted)
-            utils.append(hosted, "HostElements", host)
+def is_shade(ifc_boundary) -> bool:
+    return (ifc_boundary.Name or "").lower().startswith("shade")
+
+
+def associate_host_element(ifc_graph, fc_elements):
+    """fc_elements: FreeCAD elements by GlobalId"""
+    for ifc_entity in ifc_graph.elements:
+        ifc_host = ifc_graph.host(ifc_entity)
+        if not ifc_host:
+            continue
+        host = fc_elements.get(ifc_host.GlobalId)
+        if not host:
+            logger.error(
+                f"""Unable to get element by {ifc_host.GlobalId}.
+This error is known to occurs when you model 2 parallel walls instead of a multilayer wall."""
+            )
+            continue
+        hosted = fc_elements[ifc_entity.GlobalId]
+        utils.append(host, "HostedElements", hosted)
+        utils.append(hosted, "HostElements", host)
 
 
 def get_host(boundary, hosts):
@@ -466,14 +525,20 @@ def remove_invalid_inner_wire(boundary, boundaries):
         inner_wires = utils.get_inner_wires(host)
         for wire in inner_wires:
             if abs(Part.Face(wire).Area - area) < TOLERANCE:
+                previous_shape = host.Shape.copy()
                 utils.remove_inner_wire(host, wire)
-                utils.update_boundary_shape(host)
+                try:
+                    utils.update_boundary_shape(host)
+                except BudgetExceeded as err:
+                    logger.warning(f"Invalid inner wire of boundary <{host.Id}> kept: {err}")
+                    host.Shape = previous_shape
                 return
 
 
-def associate_inner_boundaries(fc_boundaries, doc):
+def associate_inner_boundaries(fc_boundaries):
     """Associate parent boundary and inner boundaries"""
     to_delete = []
+    space_boundaries = set(fc_boundaries)
     for fc_boundary in fc_boundaries:
         if not fc_boundary.IsHosted or fc_boundary.ParentBoundary:
             continue
@@ -481,7 +546,7 @@ def associate_inner_boundaries(fc_boundaries, doc):
         for host_element in fc_boundary.RelatedBuildingElement.HostElements:
             host_boundaries.extend(host_element.ProvidesBoundaries)
 
-        candidates = set(fc_boundaries).intersection(host_boundaries)
+        candidates = space_boundaries.intersection(host_boundaries)
 
         try:
             host = get_host(fc_boundary, candidates)
@@ -499,39 +564,36 @@ def associate_inner_boundaries(fc_boundaries, doc):
     for boundary in to_delete:
         remove_invalid_inner_wire(boundary, updated_boundaries)
         updated_boundaries.remove(boundary)
-        doc.removeObject(boundary.Name)
-
-
-def associate_parent_and_corresponding(ifc_file, doc):
-    try:
-        for boundary in ifc_file.by_type("IfcRelSpaceBoundary2ndLevel"):
-            if boundary.ParentBoundary:
-                fc_boundary = utils.get_object(boundary, doc)
-                fc_parent = utils.get_object(boundary.ParentBoundary, doc)
-                fc_boundary.ParentBoundary = fc_parent
-                utils.append(fc_parent, "InnerBoundaries", fc_boundary)
-            if boundary.CorrespondingBoundary:
-                fc_boundary = utils.get_object(boundary, doc)
-                if fc_boundary.CorrespondingBoundary:
-                    continue
-                fc_corresponding_boundary = utils.get_object(boundary.CorrespondingBoundary, doc)
-                fc_boundary.CorrespondingBoundary = fc_corresponding_boundary
-                fc_corresponding_boundary.CorrespondingBoundary = fc_boundary
-    except RuntimeError:
-        # When entity do not exist in the schema
-        pass
+        utils.remove_later(boundary)
+
+
+def associate_parent_and_corresponding(ifc_graph, doc):
+    for boundary in ifc_graph.with_parent:
+        fc_boundary = utils.get_object(boundary, doc)
+        fc_parent = utils.get_object(boundary.ParentBoundary, doc)
+        fc_boundary.ParentBoundary = fc_parent
+        utils.append(fc_parent, "InnerBoundaries", fc_boundary)
+    for boundary in ifc_graph.with_corresponding:
+        fc_boundary = utils.get_object(boundary, doc)
+        if fc_boundary.CorrespondingBoundary:
+            continue
+        fc_corresponding_boundary = utils.get_object(boundary.CorrespondingBoundary, doc)
+        fc_boundary.CorrespondingBoundary = fc_corresponding_boundary
+        fc_corresponding_boundary.CorrespondingBoundary = fc_boundary
 
 
 def associate_corresponding_boundaries(doc=FreeCAD.ActiveDocument):
     # Associate CorrespondingBoundary
-    for fc_boundary in get_elements_by_ifctype("IfcRelSpaceBoundary", doc):
-        associate_corresponding_boundary(fc_boundary, doc)
+    for fc_boundary in utils.get_elements_by_ifctype("IfcRelSpaceBoundary", doc):
+        if utils.is_removed(fc_boundary):
+            continue
+        associate_corresponding_boundary(fc_boundary)
 
 
 def cleaned_corresponding_candidates(boundary1):
     candidates = []
     for boundary2 in getattr(boundary1.RelatedBuildingElement, "ProvidesBoundaries", ()):
-        if boundary2 is boundary1:
+        if boundary2 is boundary1 or utils.is_removed(boundary2):
             continue
         if boundary2.CorrespondingBoundary:
             continue
@@ -571,7 +633,7 @@ def seems_too_smal(boundary) -> bool:
             return False
 
 
-def associate_corresponding_boundary(boundary, doc):
+def associate_corresponding_boundary(boundary):
     """Associate corresponding boundaries according to IFC definition.
 
     Reference to the other space boundary of the pair of two space boundaries on either side of a
@@ -592,7 +654,7 @@ def associate_corresponding_boundary(boundary, doc):
     Boundary {boundary.Label} from space {boundary.RelatingSpace.Id} has been removed.
     It is VIRTUAL, INTERNAL, thin and has no corresponding boundary. It looks like a parasite."""
         )
-        doc.removeObject(boundary.Name)
+        utils.remove_later(boundary)
     else:
         # Considering test above. Assume that it has been missclassified but log the issue.
         boundary.InternalOrExternalBoundary = "EXTERNAL"
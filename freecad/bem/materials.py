@@ -12,7 +12,8 @@ import re
 import typing
 import ifcopenshell
 import FreeCAD
-from freecad.bem import utils
+from freecad.bem import ids, utils
+from freecad.bem.entities import ProxyState
 
 if typing.TYPE_CHECKING:
     from freecad.bem.typing import (  # pylint: disable=no-name-in-module, import-error
@@ -23,13 +24,22 @@ if typing.TYPE_CHECKING:
 
 
 class MaterialCreator:
+    """Create material definitions. Definitions with same content (materials,
+    thicknesses, fractions, psets…) are created once and shared by every element."""
+
     def __init__(self, ifc_importer=None):
         self.obj = None
         self.ifc_entity = None
+        # Created material definitions by content key
         self.materials = {}
         self.material_layer_sets = {}
         self.material_constituent_sets = {}
         self.material_profile_sets = {}
+        # Created material definition by ifc entity id and content key by IfcMaterial id
+        self.entity_materials = {}
+        self.material_keys = {}
+        # Ids of ifc entities already used by a definition. See new_variant.
+        self.entity_ids = set()
         self.ifc_scale = 1
         self.fc_scale = 1
         if ifc_importer:
@@ -46,7 +56,7 @@ class MaterialCreator:
         self.parse_associations(ifc_entity)
         if self.obj.Material:
             return
-        entity_type = ifcopenshell.util.element.get_type(ifc_entity)
+        entity_type = self.get_type(ifc_entity)
         if entity_type:
             self.parse_associations(entity_type)
             if self.obj.Material:
@@ -63,22 +73,34 @@ class MaterialCreator:
                 ifc_entity.ObjectPlacement
             )
 
+    def get_type(self, ifc_entity):
+        graph = getattr(self.ifc_importer, "graph", None)
+        if graph:
+            return graph.element_type(ifc_entity)
+        return ifcopenshell.util.element.get_type(ifc_entity)
+
+    def associated_materials(self, ifc_entity):
+        graph = getattr(self.ifc_importer, "graph", None)
+        if graph:
+            return graph.associated_materials(ifc_entity)
+        return [
+            association.RelatingMaterial
+            for association in ifc_entity.HasAssociations
+            if association.is_a("IfcRelAssociatesMaterial")
+        ]
+
     def parse_associations(self, ifc_entity):
-        for association in ifc_entity.HasAssociations:
-            if association.is_a("IfcRelAssociatesMaterial"):
-                material_select = association.RelatingMaterial
-                if self.is_material_definition(material_select):
-                    self.assign_material(material_select)
-                elif material_select.is_a("IfcMaterialLayerSetUsage"):
-                    self.create_layer_set_usage(material_select)
-                elif material_select.is_a("IfcMaterialList"):
-                    self.create_constituent_set_from_material_list(
-                        material_select, ifc_entity
-                    )
-                else:
-                    raise NotImplementedError(
-                        f"{material_select.is_a()} not handled yet"
-                    )
+        for material_select in self.associated_materials(ifc_entity):
+            if self.is_material_definition(material_select):
+                self.assign_material(material_select)
+            elif material_select.is_a("IfcMaterialLayerSetUsage"):
+                self.create_layer_set_usage(material_select)
+            elif material_select.is_a("IfcMaterialList"):
+                self.create_constituent_set_from_material_list(
+                    material_select, ifc_entity
+                )
+            else:
+                raise NotImplementedError(f"{material_select.is_a()} not handled yet")
 
     @staticmethod
     def is_material_definition(material_select):
@@ -96,9 +118,10 @@ class MaterialCreator:
         return material_select.is_a() in valid_class
 
     def create_layer_set_usage(self, usage):
-        self.assign_material(usage.ForLayerSet)
-        self.obj.Material.LayerSetDirection = usage.LayerSetDirection
-        self.obj.Material.DirectionSense = usage.DirectionSense
+        self.obj.Material = self.create_layer_set(
+            usage.ForLayerSet, usage.LayerSetDirection, usage.DirectionSense
+        )
+        utils.append(self.obj.Material, "AssociatedTo", self.obj)
 
     def assign_material(self, material_select):
         if material_select.is_a("IfcMaterial"):
@@ -113,38 +136,92 @@ class MaterialCreator:
         else:
             raise NotImplementedError(f"{material_select.is_a()} not handled yet")
 
+    def material_key(self, material) -> tuple:
+        """IfcMaterial content written to xml: name, description, category and psets"""
+        key = self.material_keys.get(material.id())
+        if key is None:
+            psets = []
+            for pset in getattr(material, "HasProperties", ()):
+                for prop in pset.Properties:
+                    if prop.Name in Material.psets_dict.get(pset.Name, ()):
+                        value = getattr(prop, "NominalValue", None)
+                        value = value and value.wrappedValue
+                        psets.append((pset.Name, prop.Name, value))
+            key = (
+                material.Name,
+                getattr(material, "Description", None),
+                getattr(material, "Category", None),
+                tuple(sorted(psets)),
+            )
+            self.material_keys[material.id()] = key
+        return key
+
     def create_single(self, material):
-        if material.Name not in self.materials:
+        key = self.material_key(material)
+        if key not in self.materials:
             return self.create_new_single(material)
-        return self.materials[material.Name]
+        return self.materials[key]
 
     def create_new_single(self, material):
         fc_material = Material.create(material)
-        self.materials[material.Name] = fc_material
+        self.materials[self.material_key(material)] = fc_material
         return fc_material
 
-    def create_layer_set(self, layer_set):
-        if layer_set.LayerSetName not in self.material_layer_sets:
+    def new_variant(self, fc_material, ifc_entity):
+        """An ifc entity may give several definitions (orientation, element thicknesses).
+        Each one needs its own Id in xml."""
+        if ifc_entity.id() in self.entity_ids:
+            fc_material.Id = ids.new_id(FreeCAD.ActiveDocument)
+            fc_material.Label = f"{fc_material.Id}_{fc_material.IfcName}"
+        self.entity_ids.add(ifc_entity.id())
+
+    def create_layer_set(self, layer_set, direction=None, sense="POSITIVE"):
+        """Layer orientation is stored on the layer set and layers are reordered in place by
+        boundaries.ensure_materials_layers_order so it is part of the key"""
+        direction = direction or layer_set_direction(self.ifc_entity)
+        entity_key = (layer_set.id(), direction, sense)
+        if entity_key in self.entity_materials:
+            return self.entity_materials[entity_key]
+        layers = []
+        layers_thickness = []
+        for layer in layer_set.MaterialLayers:
+            layers.append(self.create_single(layer.Material))
+            layers_thickness.append(layer.LayerThickness * self.ifc_scale)
+        key = (direction, sense) + tuple(
+            (self.material_key(layer.Material), thickness)
+            for layer, thickness in zip(layer_set.MaterialLayers, layers_thickness)
+        )
+        fc_layer_set = self.material_layer_sets.get(key)
+        if not fc_layer_set:
             fc_layer_set = LayerSet.create(layer_set, building_element=self.ifc_entity)
-            layers = []
-            layers_thickness = []
-            for layer in layer_set.MaterialLayers:
-                layers.append(self.create_single(layer.Material))
-                layers_thickness.append(layer.LayerThickness * self.ifc_scale)
+            self.new_variant(fc_layer_set, layer_set)
+            if direction:
+                fc_layer_set.LayerSetDirection = direction
+            fc_layer_set.DirectionSense = sense
             fc_layer_set.MaterialLayers = layers
             fc_layer_set.Thicknesses = layers_thickness
             if not fc_layer_set.TotalThickness:
                 fc_layer_set.TotalThickness = sum(layers_thickness) * self.fc_scale
-            self.material_layer_sets[fc_layer_set.IfcName] = fc_layer_set
-            return fc_layer_set
-        return self.material_layer_sets[layer_set.LayerSetName]
+            self.material_layer_sets[key] = fc_layer_set
+        self.entity_materials[entity_key] = fc_layer_set
+        return fc_layer_set
 
     def create_constituent_set(self, constituent_set):
-        if constituent_set.Name in self.material_constituent_sets:
-            return self.material_constituent_sets[constituent_set.Name]
         # In MVD IFC4RV IfcMaterialLayerSet do not exist. Layer thicknesses are stored in a
         # quantity set. See: https://standards.buildingsmart.org/MVD/RELEASE/IFC4/ADD2_TC1/RV1_2/HTML/link/ifcmaterialconstituent.htm
         # Also see bsi forum: https://forums.buildingsmart.org/t/why-are-material-layer-sets-excluded-from-ifc4-reference-view-mvd/3638
+        layers = self.element_layers_thickness()
+        if layers:
+            return self.create_layer_set_from_constituents(constituent_set, layers)
+        # Constituent set which cannot be converted to layer sets eg. windows, complex walls
+        entity_id = constituent_set.id()
+        if entity_id not in self.entity_materials:
+            fc_material = self.create_new_constituent_set(constituent_set)
+            self.entity_materials[entity_id] = fc_material
+        return self.entity_materials[entity_id]
+
+    def element_layers_thickness(self):
+        """Layer thicknesses by name from element quantity sets"""
         layers = {}
         for rel_definition in getattr(self.ifc_entity, "IsDefinedBy", ()):
             definition = rel_definition.RelatingPropertyDefinition
@@ -158,23 +235,32 @@ class MaterialCreator:
                     layers[quantity.Name] = (
                         quantity.HasQuantities[0].LengthValue * self.ifc_scale
                     )
-        if layers:
+        return layers
+
+    def create_layer_set_from_constituents(self, constituent_set, layers):
+        thicknesses = []
+        materiallayers = []
+        for layer in constituent_set.MaterialConstituents:
+            thicknesses.append(layers[layer.Name])
+            materiallayers.append(self.create_single(layer.Material))
+        key = ("Layers", layer_set_direction(self.ifc_entity)) + tuple(
+            (self.material_key(layer.Material), thickness)
+            for layer, thickness in zip(
+                constituent_set.MaterialConstituents, thicknesses
+            )
+        )
+        if key not in self.material_constituent_sets:
             fc_layer_set = LayerSet.create(
                 constituent_set, building_element=self.ifc_entity
             )
-            thicknesses = []
-            materiallayers = []
-            for layer in constituent_set.MaterialConstituents:
-                thicknesses.append(layers[layer.Name])
-                materiallayers.append(self.create_single(layer.Material))
+            self.new_variant(fc_layer_set, constituent_set)
             fc_layer_set.Thicknesses = thicknesses
             fc_layer_set.TotalThickness = sum(thicknesses) * self.fc_scale
             fc_layer_set.MaterialLayers = materiallayers
-            self.material_constituent_sets[fc_layer_set.IfcName] = fc_layer_set
-            return fc_layer_set
+            self.material_constituent_sets[key] = fc_layer_set
+        return self.material_constituent_sets[key]
 
-        # Constituent set which cannot be converted to layer sets eg. windows, complex walls
-        fc_constituent_set = ConstituentSet.create(constituent_set)
+    def create_new_constituent_set(self, constituent_set):
         constituents = []
         constituents_fraction = []
         constituents_categories = []
@@ -182,40 +268,67 @@ class MaterialCreator:
             constituents.append(self.create_single(constituent.Material))
             constituents_fraction.append(constituent.Fraction or 0)
             constituents_categories.append(constituent.Category or "")
-        fc_constituent_set.MaterialConstituents = constituents
-        fc_constituent_set.Fractions = constituents_fraction
-        fc_constituent_set.Categories = constituents_categories
-        self.material_constituent_sets[fc_constituent_set.IfcName] = fc_constituent_set
-        return fc_constituent_set
+        key = ("Constituents",) + tuple(
+            zip(
+                (
+                    self.material_key(constituent.Material)
+                    for constituent in constituent_set.MaterialConstituents
+                ),
+                constituents_fraction,
+                constituents_categories,
+            )
+        )
+        if key not in self.material_constituent_sets:
+            fc_constituent_set = ConstituentSet.create(constituent_set)
+            self.new_variant(fc_constituent_set, constituent_set)
+            fc_constituent_set.MaterialConstituents = constituents
+            fc_constituent_set.Fractions = constituents_fraction
+            fc_constituent_set.Categories = constituents_categories
+            self.material_constituent_sets[key] = fc_constituent_set
+        return self.material_constituent_sets[key]
 
     def create_constituent_set_from_material_list(self, material_list, ifc_element):
+        materials = material_list.Materials
+        key = ("MaterialList",) + tuple(self.material_key(m) for m in materials)
+        if key in self.material_constituent_sets:
+            self.obj.Material = self.material_constituent_sets[key]
+            return
         constituent_set = ConstituentSet.create()
         constituent_set.IfcType = material_list.is_a()
         constituent_set.IfcName = self.get_type_name(ifc_element) or "NoTypeName"
         constituent_set.Id = material_list.id()
         constituent_set.Label = f"{constituent_set.Id}_{constituent_set.IfcName}"
-        materials = material_list.Materials
         constituent_set.Fractions = [1 / len(materials)] * len(materials)
         constituent_set.Categories = ["MaterialList"] * len(materials)
         material_constituents = list()
         for material in materials:
             material_constituents.append(self.create_single(material))
         constituent_set.MaterialConstituents = material_constituents
+        utils.register(constituent_set)
+        self.material_constituent_sets[key] = constituent_set
         self.obj.Material = constituent_set
 
     def create_profile_set(self, profile_set):
-        if profile_set.Name not in self.material_profile_sets:
+        if profile_set.id() in self.entity_materials:
+            return self.entity_materials[profile_set.id()]
+        profiles = []
+        profiles_categories = []
+        for profile in profile_set.MaterialProfiles:
+            profiles.append(self.create_single(profile.Material))
+            profiles_categories.append(profile.Category or "")
+        key = tuple(
+            zip(
+                (self.material_key(p.Material) for p in profile_set.MaterialProfiles),
+                profiles_categories,
+            )
+        )
+        if key not in self.material_profile_sets:
             fc_profile_set = ProfileSet.create(profile_set)
-            profiles = []
-            profiles_categories = []
-            for profile in profile_set.MaterialProfiles:
-                profiles.append(self.create_single(profile.Material))
-                profiles_categories.append(profile.Category or "")
             fc_profile_set.MaterialProfiles = profiles
             fc_profile_set.Categories = profiles_categories
-            self.material_profile_sets[fc_profile_set.IfcName] = fc_profile_set
-            return fc_profile_set
-        return self.material_profile_sets[profile_set.Name]
+            self.material_profile_sets[key] = fc_profile_set
+        self.entity_materials[profile_set.id()] = self.material_profile_sets[key]
+        return self.material_profile_sets[key]
 
     def get_type_name(self, ifc_element):
         if ifc_element.is_a("IfcTypeObject"):
@@ -227,7 +340,7 @@ class MaterialCreator:
                 return definition.RelatingType.Name
 
 
-class ConstituentSet:
+class ConstituentSet(ProxyState):
     attributes = ()
     psets_dict = {}
     parts_name = "Constituents"
@@ -250,6 +363,7 @@ class ConstituentSet:
             "Part::FeaturePython", "MaterialConstituentSet"
         )
         ConstituentSet(obj, ifc_entity)
+        utils.register(obj)
         return obj
 
     def _init_properties(self, obj: "ConstituentSetFeature", ifc_entity) -> None:
@@ -271,7 +385,7 @@ class ConstituentSet:
         obj.IfcType = ifc_entity.is_a()
 
 
-class LayerSet:
+class LayerSet(ProxyState):
     attributes = ("TotalThickness",)
     psets_dict = {}
     parts_name = "Layers"
@@ -294,6 +408,7 @@ class LayerSet:
         """
         obj = FreeCAD.ActiveDocument.addObject("Part::FeaturePython", "Material")
         LayerSet(obj, ifc_entity, building_element)
+        utils.register(obj)
         return obj
 
     def _init_properties(self, obj: "LayerSetFeature", ifc_entity) -> None:
@@ -324,18 +439,23 @@ class LayerSet:
         obj.Description = getattr(ifc_entity, "Description", None) or ""
         obj.Label = f"{obj.Id}_{obj.IfcName}"
         obj.IfcType = ifc_entity.is_a()
-        building_element = self.building_element
-        if building_element.is_a("IfcWall") or building_element.is_a("IfcWallType"):
-            obj.LayerSetDirection = "AXIS2"
-        else:
-            for ifc_class in ["IfcSlab", "IfcSlabType", "IfcRoof", "IfcRoofType"]:
-                if building_element.is_a(ifc_class):
-                    obj.LayerSetDirection = "AXIS3"
-                    break
+        direction = layer_set_direction(self.building_element)
+        if direction:
+            obj.LayerSetDirection = direction
         obj.DirectionSense = "POSITIVE"
 
 
-class Material:
+def layer_set_direction(building_element):
+    """Default layer set direction according to building element class"""
+    if building_element.is_a("IfcWall") or building_element.is_a("IfcWallType"):
+        return "AXIS2"
+    for ifc_class in ["IfcSlab", "IfcSlabType", "IfcRoof", "IfcRoofType"]:
+        if building_element.is_a(ifc_class):
+            return "AXIS3"
+    return None
+
+
+class Material(ProxyState):
     attributes = ("Category",)
     psets_dict = {
         "Pset_MaterialCommon": ("MassDensity", "Porosity"),
@@ -370,6 +490,7 @@ class Material:
         """
         obj = FreeCAD.ActiveDocument.addObject("Part::FeaturePython", "Material")
         cls(obj, ifc_entity)
+        utils.register(obj)
         return obj
 
     def _init_properties(self, obj) -> None:
@@ -419,7 +540,7 @@ class Material:
             setattr(obj, "MaterialsDBLayerId", m.group(1))
 
 
-class ProfileSet:
+class ProfileSet(ProxyState):
     attributes = ()
     psets_dict = {}
     parts_name = "Profiles"
@@ -445,6 +566,7 @@ class ProfileSet:
             "Part::FeaturePython", "MaterialProfileSet"
         )
         ProfileSet(obj, ifc_entity)
+        utils.register(obj)
         return obj
 
     def _init_properties(self, obj: "ProfileSetFeature", ifc_entity) -> None:
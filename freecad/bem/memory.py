@@ -0,0 +1,164 @@
+# coding: utf8
+"""This module measure memory used by each pipeline stage on demand.
+
+© All rights reserved.
+ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland, Laboratory CNPA, 2019-2020
+
+See the LICENSE.TXT file for more details.
+
+Author : Cyril Waechter
+"""
+import collections
+import contextlib
+import os
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+import FreeCAD
+
+from freecad.bem.bem_logging import logger
+from freecad.bem.profiling import resolve_directory
+from freecad.bem.progress import Progress
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Directory receiving memory report. "1" or "true" use default directory (eg. output xml one).
+ENV_VAR = "BIMXBEM_MEMORY"
+REPORT_NAME = "memory_report.txt"
+TRACEBACK_FRAMES = 5
+
+
+def peak_rss() -> Optional[int]:
+    """Peak resident set size of current process in bytes"""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return max_rss if os.uname().sysname == "Darwin" else max_rss * 1024
+
+
+def current_rss() -> Optional[int]:
+    """Current resident set size of current process in bytes. Only available on Linux."""
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def count_objects() -> Dict[str, int]:
+    """Live FreeCAD objects of every open document by proxy class (RelSpaceBoundary, Material…)"""
+    counts: Dict[str, int] = collections.Counter()
+    for doc in FreeCAD.listDocuments().values():
+        for obj in doc.Objects:
+            proxy = getattr(obj, "Proxy", None)
+            counts[type(proxy).__name__ if proxy is not None else obj.TypeId] += 1
+    return counts
+
+
+def take_snapshot() -> tracemalloc.Snapshot:
+    """Snapshot excluding tracemalloc and import machinery own allocations"""
+    return tracemalloc.take_snapshot().filter_traces(
+        (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        )
+    )
+
+
+def format_size(size: Optional[int]) -> str:
+    if size is None:
+        return "n/a"
+    return f"{size / 2 ** 20:.1f} MiB"
+
+
+class StageMemory:
+    """Take a tracemalloc snapshot, RSS and FreeCAD object counts at each Progress step.
+    tracemalloc only sees Python allocations. OpenCascade shapes are only visible in RSS."""
+
+    def __init__(self, directory: str, top: int = 20) -> None:
+        self.directory = directory
+        self.top = top
+        self.stage_name = ""
+        self.stage_start = 0.0
+        self.snapshot = None
+        self.owns_tracing = False
+        self.sections: List[str] = []
+
+    def start(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEBACK_FRAMES)
+            self.owns_tracing = True
+        Progress.current_step_id = ""
+        Progress.step_listeners.append(self.on_step)
+        self.start_stage("start")
+
+    def stop(self) -> None:
+        Progress.step_listeners.remove(self.on_step)
+        self.stop_stage()
+        self.snapshot = None
+        if self.owns_tracing:
+            tracemalloc.stop()
+        self.write_report()
+
+    def on_step(self, step_id: str) -> None:
+        self.stop_stage()
+        self.start_stage(step_id)
+
+    def start_stage(self, name: str) -> None:
+        self.stage_name = f"{len(self.sections):02d}_{name}"
+        self.stage_start = time.perf_counter()
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        self.snapshot = take_snapshot()
+
+    def stop_stage(self) -> None:
+        if self.snapshot is None:
+            return
+        traced, traced_peak = tracemalloc.get_traced_memory()
+        snapshot = take_snapshot()
+        lines = [
+            f"===== {self.stage_name} ({time.perf_counter() - self.stage_start:.1f} s) =====",
+            f"RSS: {format_size(current_rss())}, peak RSS: {format_size(peak_rss())}",
+            f"Python traced: {format_size(traced)}, stage peak: {format_size(traced_peak)}",
+            "FreeCAD objects:",
+        ]
+        counts = count_objects()
+        lines.extend(f"  {name}: {count}" for name, count in sorted(counts.items(), key=lambda item: -item[1]))
+        lines.append(f"Top {self.top} allocation sites growth:")
+        growths = [stat for stat in snapshot.compare_to(self.snapshot, "lineno") if stat.size_diff]
+        for stat in growths[: self.top]:
+            frame = stat.traceback[0]
+            lines.append(
+                f"  {format_size(stat.size_diff)} ({stat.count_diff:+d} blocks) {frame.filename}:{frame.lineno}"
+            )
+        self.sections.append("\n".join(lines))
+        self.snapshot = None
+
+    def write_report(self) -> None:
+        path = os.path.join(self.directory, REPORT_NAME)
+        with open(path, "w", encoding="utf-8") as report:
+            report.write("\n\n".join(self.sections))
+            report.write("\n")
+        logger.info(f"Memory report written to {path}")
+
+
+@contextlib.contextmanager
+def track_memory(directory: str = None, default_directory: str = "."):
+    """Report memory used by pipeline stages if directory is given or ENV_VAR is set. Do nothing
+    otherwise."""
+    directory = resolve_directory(directory, ENV_VAR, default_directory)
+    if not directory:
+        yield None
+        return
+    tracker = StageMemory(directory)
+    tracker.start()
+    try:
+        yield tracker
+    finally:
+        tracker.stop()
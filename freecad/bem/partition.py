@@ -0,0 +1,220 @@
+# coding: utf8
+"""This module split multi-building models in independent groups of spaces which are processed
+separately then merged in a single bimbem xml.
+
+© All rights reserved.
+ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland, Laboratory CNPA, 2019-2020
+
+See the LICENSE.TXT file for more details.
+
+Author : Cyril Waechter
+"""
+import copy
+import multiprocessing
+import xml.etree.ElementTree as ET
+from multiprocessing import resource_tracker
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+import ifcopenshell
+
+import FreeCAD
+
+from freecad.bem import boundaries
+from freecad.bem import ids
+from freecad.bem import utils
+from freecad.bem.bem_logging import LOG_STREAM
+from freecad.bem.bem_xml import BEMxml
+from freecad.bem.geometry_store import GeometryStore, SharedArray
+from freecad.bem.ids import IdAllocator
+from freecad.bem.ifc_importer import IfcImporter
+
+# Generated ids of each partition are allocated within a block of this size
+PARTITION_ID_BLOCK = 1000000
+
+
+class SpaceUnionFind:
+    """Group spaces connected by a shared building element or a corresponding boundary"""
+
+    def __init__(self, space_ids: Iterable[int]) -> None:
+        self.parents = {space_id: space_id for space_id in space_ids}
+
+    def find(self, space_id: int) -> int:
+        root = space_id
+        while self.parents[root] != root:
+            root = self.parents[root]
+        while self.parents[space_id] != root:
+            self.parents[space_id], space_id = root, self.parents[space_id]
+        return root
+
+    def union(self, space_ids: Iterable[int]) -> None:
+        roots = {self.find(space_id) for space_id in space_ids if space_id in self.parents}
+        if len(roots) < 2:
+            return
+        main_root = min(roots)
+        for root in roots:
+            self.parents[root] = main_root
+
+    def groups(self) -> List[List[int]]:
+        groups: Dict[int, List[int]] = {}
+        for space_id in self.parents:
+            groups.setdefault(self.find(space_id), []).append(space_id)
+        return sorted((sorted(group) for group in groups.values()), key=lambda group: group[0])
+
+
+def space_partitions(ifc_file) -> List[List[int]]:
+    """Independent groups of IfcSpace ids. Spaces of different groups never share a building element
+    nor a corresponding boundary so they can be processed separately."""
+    union_find = SpaceUnionFind(space.id() for space in ifc_file.by_type("IfcSpace") if space.BoundedBy)
+    for element in ifc_file.by_type("IfcElement"):
+        union_find.union(b.RelatingSpace.id() for b in element.ProvidesBoundaries)
+    for boundary in ifc_file.by_type("IfcRelSpaceBoundary"):
+        # CorrespondingBoundary do not exist in IFC2x3
+        corresponding = getattr(boundary, "CorrespondingBoundary", None)
+        if corresponding:
+            union_find.union((boundary.RelatingSpace.id(), corresponding.RelatingSpace.id()))
+    return union_find.groups()
+
+
+class PartitionResult(NamedTuple):
+    xml: str
+    log: str
+    # Shared GeometryStore holding polygons referenced by xml. See read_partition_xml.
+    geometry: Optional[Dict[str, SharedArray]] = None
+
+
+def process_partition(
+    ifc_path: str, space_ids: List[int], id_base: int, tier: str, share_geometry: bool = False
+) -> PartitionResult:
+    """Process a group of spaces in its own document.
+    share_geometry: polygons are left in shared memory instead of being written to xml text"""
+    log_start = LOG_STREAM.tell()
+    doc = FreeCAD.newDocument()
+    try:
+        ifc_importer = IfcImporter(ifc_path, doc, space_ids, IdAllocator(id_base))
+        ifc_importer.generate_rel_space_boundaries()
+        boundaries.processing_sia_boundaries(doc, tier)
+        store = ifc_importer.geometry_store(shared=True) if share_geometry else None
+        bem_xml = boundaries.write_xml(
+            doc,
+            ifc_importer.ifc_file,
+            tier,
+            geometry_store=store,
+            shades=ifc_importer.shades,
+            reference_geometry=share_geometry,
+        )
+        xml_str = bem_xml.tostring()
+        descriptor = None
+        if store is not None:
+            descriptor = store.descriptor()
+            # Shared memory lives until parent process unlinks it
+            store.close()
+    finally:
+        ids.unregister(doc)
+        utils.forget_registry(doc)
+        FreeCAD.closeDocument(doc.Name)
+    return PartitionResult(xml_str, LOG_STREAM.getvalue()[log_start:], descriptor)
+
+
+def read_partition_xml(result: PartitionResult) -> ET.Element:
+    """Parse partition xml and write polygons it references from partition shared geometry store"""
+    root = ET.fromstring(result.xml)
+    if result.geometry is None:
+        return root
+    store = GeometryStore.attach(result.geometry)
+    try:
+        BEMxml().write_stored_polygons(root, store)
+    finally:
+        store.close()
+        store.unlink()
+    return root
+
+
+def generate_partitioned_bem_xml_from_file(
+    ifc_path: str, tier: str = "standard", processes: int = 1
+) -> boundaries.XmlResult:
+    """Same as boundaries.generate_bem_xml_from_file but each independent group of spaces (eg. each
+    building of a campus) is processed in its own document, optionally in parallel processes."""
+    boundaries.check_tier(tier)
+    ifc_file = ifcopenshell.open(ifc_path)
+    partitions = space_partitions(ifc_file)
+    id_allocator = IdAllocator.from_ifc(ifc_file)
+    del ifc_file
+    tasks = [
+        (ifc_path, space_ids, id_allocator.allocate_block(PARTITION_ID_BLOCK), tier) for space_ids in partitions
+    ]
+    if processes > 1 and len(tasks) > 1:
+        method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+        # Workers share parent tracker so shared geometry is not released when a worker exits
+        resource_tracker.ensure_running()
+        with multiprocessing.get_context(method).Pool(min(processes, len(tasks))) as pool:
+            results = pool.starmap(process_partition, [(*task, True) for task in tasks])
+            roots = [read_partition_xml(result) for result in results]
+    else:
+        results = [process_partition(*task) for task in tasks]
+        roots = [read_partition_xml(result) for result in results]
+    merged = merge_bem_xml(roots)
+    return boundaries.XmlResult(ET.tostring(merged, encoding="unicode"), "".join(r.log for r in results))
+
+
+# Tags of bimbem entities identified by their Id child
+ENTITY_TAGS = {
+    "Project",
+    "Site",
+    "Building",
+    "Storey",
+    "Zone",
+    "Space",
+    "Boundary",
+    "BuildingElementType",
+    "BuildingElement",
+    "Material",
+    "LayerSet",
+    "ConstituentSet",
+    "ProfileSet",
+    "Shade",
+}
+# Containers of references to other entities by Id
+ID_LISTS = {"ApplicableOccurrence", "ProvidesBoundaries", "InnerBoundaries", "Spaces", "Boundaries"}
+
+
+def element_key(xml_element, parent_tag: str, occurence: int) -> tuple:
+    """Entities with an Id are the same entity. Id list items are matched by content so lists are
+    merged as a union. Other children are matched by position among siblings of same tag."""
+    if xml_element.tag in ENTITY_TAGS:
+        xml_id = xml_element.find("Id")
+        if xml_id is not None:
+            return ("Entity", xml_element.tag, xml_id.text)
+    if parent_tag in ID_LISTS and not len(xml_element):
+        return ("Item", xml_element.tag, xml_element.text)
+    return ("Child", xml_element.tag, occurence)
+
+
+def merge_xml_element(target, source) -> None:
+    """Recursively append source children missing from target. Values already in target are kept."""
+    existing = {}
+    occurences: Dict[str, int] = {}
+    for child in target:
+        occurence = occurences[child.tag] = occurences.get(child.tag, -1) + 1
+        existing.setdefault(element_key(child, target.tag, occurence), child)
+    occurences.clear()
+    for child in source:
+        occurence = occurences[child.tag] = occurences.get(child.tag, -1) + 1
+        key = element_key(child, source.tag, occurence)
+        if key not in existing:
+            existing[key] = copy.deepcopy(child)
+            target.append(existing[key])
+        elif len(child):
+            merge_xml_element(existing[key], child)
+
+
+def merge_bem_xml(roots: Iterable[ET.Element]) -> ET.Element:
+    """Merge bimbem xml produced for each partition. Shared entities (project, sites, materials…)
+    are written once."""
+    merged = None
+    for root in roots:
+        if merged is None:
+            merged = root
+            continue
+        merged.attrib.update(root.attrib)
+        merge_xml_element(merged, root)
+    return merged if merged is not None else ET.Element("bimbem")
@@ -0,0 +1,120 @@
+# coding: utf8
+"""This module profile each pipeline stage separately on demand.
+
+© All rights reserved.
+ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland, Laboratory CNPA, 2019-2020
+
+See the LICENSE.TXT file for more details.
+
+Author : Cyril Waechter
+"""
+import contextlib
+import cProfile
+import importlib.util
+import os
+import pstats
+from typing import List, Optional, Tuple
+
+from freecad.bem.bem_logging import logger
+from freecad.bem.progress import Progress
+
+# Directory receiving profiling results. "1" or "true" use default directory (eg. output xml one).
+ENV_VAR = "BIMXBEM_PROFILE"
+SUMMARY_NAME = "profile_summary.txt"
+
+
+def resolve_directory(directory: Optional[str], env_var: str, default_directory: str) -> Optional[str]:
+    """Directory given as argument or environment variable. None if instrumentation is disabled."""
+    directory = directory or os.environ.get(env_var)
+    if not directory or directory.lower() in ("0", "false", "no"):
+        return None
+    if directory.lower() in ("1", "true", "yes"):
+        return default_directory
+    return directory
+
+
+class StageProfiler:
+    """Profile each Progress step with pyinstrument sampling profiler when installed, cProfile
+    otherwise. Each stage is written to its own file then a merged summary is written."""
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.profiler = None
+        self.stage_name = ""
+        self.outputs: List[Tuple[str, str]] = []
+        self.sampling = importlib.util.find_spec("pyinstrument") is not None
+
+    def start(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        # Step id may be left by a previous run. First stage lasts until next Progress step.
+        Progress.current_step_id = ""
+        Progress.step_listeners.append(self.on_step)
+        self.start_stage("start")
+
+    def stop(self) -> None:
+        Progress.step_listeners.remove(self.on_step)
+        self.stop_stage()
+        self.write_summary()
+
+    def on_step(self, step_id: str) -> None:
+        self.stop_stage()
+        self.start_stage(step_id)
+
+    def start_stage(self, name: str) -> None:
+        self.stage_name = f"{len(self.outputs):02d}_{name}"
+        if self.sampling:
+            from pyinstrument import Profiler  # pylint: disable=import-outside-toplevel
+
+            self.profiler = Profiler()
+            self.profiler.start()
+        else:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def stop_stage(self) -> None:
+        if not self.profiler:
+            return
+        if self.sampling:
+            self.profiler.stop()
+            path = os.path.join(self.directory, f"{self.stage_name}.txt")
+            with open(path, "w", encoding="utf-8") as output:
+                output.write(self.profiler.output_text(unicode=True))
+        else:
+            self.profiler.disable()
+            path = os.path.join(self.directory, f"{self.stage_name}.pstats")
+            self.profiler.dump_stats(path)
+        self.outputs.append((self.stage_name, path))
+        self.profiler = None
+
+    def write_summary(self) -> None:
+        path = os.path.join(self.directory, SUMMARY_NAME)
+        with open(path, "w", encoding="utf-8") as summary:
+            if self.sampling:
+                for stage_name, stage_path in self.outputs:
+                    summary.write(f"===== {stage_name} =====\n")
+                    with open(stage_path, encoding="utf-8") as stage_output:
+                        summary.write(stage_output.read())
+            elif self.outputs:
+                for stage_name, stage_path in self.outputs:
+                    total_time = pstats.Stats(stage_path).total_tt
+                    summary.write(f"{stage_name}: {total_time:.3f} s\n")
+                summary.write("\n")
+                stats = pstats.Stats(*(stage_path for _, stage_path in self.outputs), stream=summary)
+                stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(60)
+                stats.print_callees(20)
+        logger.info(f"Profiling results written to {self.directory}")
+
+
+@contextlib.contextmanager
+def profile_stages(directory: str = None, default_directory: str = "."):
+    """Profile pipeline stages if directory is given or ENV_VAR is set. Do nothing otherwise."""
+    directory = resolve_directory(directory, ENV_VAR, default_directory)
+    if not directory:
+        yield None
+        return
+    profiler = StageProfiler(directory)
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
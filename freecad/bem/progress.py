@@ -1,5 +1,15 @@
+import os
+import threading
+import time
+
+from freecad.bem.bem_logging import logger
+
+
 class Progress:
     progress_func = None
+    # Maximum progress_func calls per second. Events are coalesced to the latest one and delivered
+    # from a background thread. Falsy value calls progress_func synchronously for every event.
+    max_rate = 10
     current_pourcentage = 0
     current_step_id = ""
     current_message = ""
@@ -9,6 +19,14 @@ class Progress:
     nb_space = 0
     nb_rel_space = 0
     nb_built_element = 0
+    # Functions called synchronously with the new step_id each time step changes (eg. profiling)
+    step_listeners = []
+    _pending = None
+    _condition = threading.Condition()
+    _call_lock = threading.Lock()
+    _dispatcher = None
+    # True once a failure of progress_func called from dispatcher thread has been logged
+    _failure_logged = False
 
     @classmethod
     def set(
@@ -21,22 +39,72 @@ class Progress:
         """Set progression during IFC import
         Pourcentage: is x as in x/100.
         step_id: step name which can be interpretable as an id for translation
-        message: is a free string message
-        pourcent_range: used for substeps"""
+        message: is a free string message, current space count by default
+        pourcent_range: used for substeps
+        Only given values are updated. See space_done to count spaces."""
         if not pourcentage is None:
             cls.current_pourcentage = pourcentage
         else:
             pourcentage = cls.current_pourcentage + cls.space_pourcentage()
         if step_id:
-            cls.current_step_id = step_id
+            if step_id != cls.current_step_id:
+                cls.current_step_id = step_id
+                for listener in list(cls.step_listeners):
+                    listener(step_id)
         else:
             step_id = cls.current_step_id
         if message is None:
             message = cls.space_count()
         if pourcent_range:
             cls.pourcent_range = pourcent_range
-        if cls.progress_func:
-            cls.progress_func(pourcentage, step_id, message)
+        cls.dispatch(pourcentage, step_id, message)
+
+    @classmethod
+    def dispatch(cls, pourcentage: int, step_id: str, message: str):
+        """Queue event for background delivery. Final 100% event is delivered synchronously after
+        pending events are dropped so it is always the last one received."""
+        if not cls.progress_func:
+            return
+        if not cls.max_rate or pourcentage >= 100:
+            with cls._call_lock:
+                with cls._condition:
+                    cls._pending = None
+                cls.progress_func(pourcentage, step_id, message)
+            return
+        with cls._condition:
+            cls._pending = (pourcentage, step_id, message)
+            cls._condition.notify()
+        if not (cls._dispatcher and cls._dispatcher.is_alive()):
+            cls._failure_logged = False
+            cls._dispatcher = threading.Thread(target=cls._dispatch_loop, daemon=True)
+            cls._dispatcher.start()
+
+    @classmethod
+    def _dispatch_loop(cls):
+        while True:
+            with cls._condition:
+                while cls._pending is None:
+                    cls._condition.wait()
+            with cls._call_lock:
+                with cls._condition:
+                    event, cls._pending = cls._pending, None
+                if event and cls.progress_func:
+                    try:
+                        cls.progress_func(*event)
+                    except Exception:  # pylint: disable=broad-except
+                        # Called up to max_rate times per second. Log once to not flood the log.
+                        if not cls._failure_logged:
+                            cls._failure_logged = True
+                            logger.exception("Progress function failed. Further failures are not logged.")
+            time.sleep(1 / cls.max_rate if cls.max_rate else 0)
+
+    @classmethod
+    def _reset_after_fork(cls):
+        """Dispatcher thread and locks are not usable in a forked child process"""
+        cls._pending = None
+        cls._condition = threading.Condition()
+        cls._call_lock = threading.Lock()
+        cls._dispatcher = None
 
     @classmethod
     def next_space(cls):
@@ -48,8 +116,13 @@ class Progress:
         return int(cls.current_space * cls.pourcent_range / cls.len_spaces)
 
     @classmethod
-    def space_count(cls):
+    def space_done(cls):
+        """Count a processed space and report progress"""
         cls.next_space()
+        cls.set()
+
+    @classmethod
+    def space_count(cls):
         return f"{cls.current_space}/{cls.len_spaces}"
 
     @classmethod
@@ -66,3 +139,7 @@ class Progress:
                 cls.nb_built_element = len(ifc_file.by_type(ifc_class))
             except RuntimeError:
                 continue
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=Progress._reset_after_fork)  # pylint: disable=protected-access
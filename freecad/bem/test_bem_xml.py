@@ -0,0 +1,22 @@
+# coding: utf8
+"""This module test formatting of bimbem xml values
+
+© All rights reserved.
+ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland, Laboratory CNPA, 2019-2020
+
+See the LICENSE.TXT file for more details.
+
+Author : Cyril Waechter
+"""
+import numpy as np
+
+from freecad.bem.bem_xml import format_points
+
+
+def test_format_points_full_precision():
+    assert format_points([1.5, 2, -0.25, 0.1, 0, 3]) == [["1.5", "2.0", "-0.25"], ["0.1", "0.0", "3.0"]]
+
+
+def test_format_points_rounded():
+    points = np.array([(1.23456, -0.00001, 2.0), (0.00006, 9.99999, -3.33333)])
+    assert format_points(points, 4) == [["1.2346", "0.0", "2.0"], ["0.0001", "10.0", "-3.3333"]]
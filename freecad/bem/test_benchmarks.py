@@ -0,0 +1,243 @@
+# coding: utf8
+"""This module benchmark geometry primitives used in inner loops of boundaries processing against
+a stored baseline.
+
+Benchmarks are skipped unless BIMXBEM_BENCHMARK is set:
+    BIMXBEM_BENCHMARK=save pytest freecad/bem/test_benchmarks.py      record baseline
+    BIMXBEM_BENCHMARK=compare pytest freecad/bem/test_benchmarks.py   fail on slowdown
+Timings are stored relative to a pure python calibration workload timed in the same session so
+baseline does not depend on the machine. Compare fails for benchmarks missing from baseline.
+
+© All rights reserved.
+ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland, Laboratory CNPA, 2019-2020
+
+See the LICENSE.TXT file for more details.
+
+Author : Cyril Waechter
+"""
+import json
+import math
+import os
+import time
+
+import pytest
+
+import FreeCAD
+import Part
+
+from freecad.bem import utils
+from freecad.bem.boundaries import (
+    SiaGeometry,
+    edge_distance_to_edge,
+    get_medial_axis,
+    merged_wires,
+)
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "benchmark_baseline.json")
+MODE = os.environ.get("BIMXBEM_BENCHMARK", "")
+# Allowed slowdown relative to baseline. 0.3 means 30 % slower.
+SLOWDOWN_TOLERANCE = float(os.environ.get("BIMXBEM_BENCHMARK_TOLERANCE", "0.3"))
+ROUNDS = 5
+ROUND_DURATION = 0.05
+
+pytestmark = pytest.mark.skipif(MODE not in ("save", "compare"), reason="Set BIMXBEM_BENCHMARK to save or compare")
+
+RESULTS = {}
+
+
+def load_baseline() -> dict:
+    try:
+        with open(BASELINE_PATH, encoding="utf-8") as baseline_file:
+            return json.load(baseline_file)
+    except FileNotFoundError:
+        return {}
+
+
+@pytest.fixture(scope="module")
+def baseline():
+    baseline = load_baseline()
+    yield baseline
+    if MODE == "save" and RESULTS:
+        baseline.update(RESULTS)
+        with open(BASELINE_PATH, "w", encoding="utf-8") as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write("\n")
+
+
+def best_time(func, *args) -> float:
+    """Best of ROUNDS rounds, each round lasting about ROUND_DURATION"""
+    start = time.perf_counter()
+    func(*args)
+    number = max(1, int(ROUND_DURATION / max(time.perf_counter() - start, 1e-9)))
+    timings = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        for _ in range(number):
+            func(*args)
+        timings.append((time.perf_counter() - start) / number)
+    return min(timings)
+
+
+def calibration_workload():
+    """Float arithmetic and small object allocations like geometry primitives' python code"""
+    points = [(math.cos(i), math.sin(i), i * 0.5) for i in range(1000)]
+    return sum(math.hypot(x2 - x1, y2 - y1, z2 - z1) for (x1, y1, z1), (x2, y2, z2) in zip(points, points[1:]))
+
+
+@pytest.fixture(scope="module")
+def calibration() -> float:
+    return best_time(calibration_workload)
+
+
+@pytest.fixture
+def bench(request, baseline, calibration):
+    """Time func(*args) relative to calibration. Record result and compare it to baseline."""
+
+    def run(func, *args):
+        result = func(*args)
+        ratio = best_time(func, *args) / calibration
+        name = request.node.name
+        RESULTS[name] = ratio
+        reference = baseline.get(name)
+        if MODE == "compare":
+            if reference is None:
+                pytest.fail(f"{name} is missing from {BASELINE_PATH}. Record it with BIMXBEM_BENCHMARK=save.")
+            assert ratio <= reference * (1 + SLOWDOWN_TOLERANCE), (
+                f"{name} took {ratio:.2f} times calibration workload, baseline is {reference:.2f}"
+            )
+        return result
+
+    return run
+
+
+@pytest.fixture(scope="module")
+def doc():
+    doc = FreeCAD.newDocument()
+    yield doc
+    FreeCAD.closeDocument(doc.Name)
+
+
+def star_points(nb_points: int, radius: float = 5000, center=(0, 0)):
+    """Polygon with many vertices alternating between 2 radius"""
+    points = []
+    for i in range(nb_points):
+        angle = 2 * math.pi * i / nb_points
+        length = radius if i % 2 else radius * 0.8
+        points.append(FreeCAD.Vector(center[0] + length * math.cos(angle), center[1] + length * math.sin(angle), 0))
+    return points
+
+
+def square_points(size: float, origin=(0, 0)):
+    x, y = origin
+    return [
+        FreeCAD.Vector(x, y, 0),
+        FreeCAD.Vector(x + size, y, 0),
+        FreeCAD.Vector(x + size, y + size, 0),
+        FreeCAD.Vector(x, y + size, 0),
+    ]
+
+
+def near_collinear_points(size: float = 10000, nb_points: int = 200):
+    """Square with many points almost aligned on its sides and duplicated points"""
+    points = []
+    for start, end in zip(square_points(size), square_points(size)[1:] + square_points(size)[:1]):
+        for i in range(nb_points):
+            point = start + (end - start) * (i / nb_points)
+            offset = utils.TOLERANCE / 2 if i % 2 else 0
+            points.append(point + FreeCAD.Vector(offset, offset, 0))
+            if i % 10 == 0:
+                points.append(FreeCAD.Vector(point))
+    return points
+
+
+def polygon(points) -> Part.Wire:
+    return Part.makePolygon(points + points[:1])
+
+
+def holed_wires(nb_holes_side: int = 10, size: float = 10000):
+    """Square outer wire with a grid of square holes"""
+    step = size / (nb_holes_side + 1)
+    hole_size = step / 2
+    inner_wires = [
+        polygon(square_points(hole_size, (step * (i + 1) - hole_size / 2, step * (j + 1) - hole_size / 2)))
+        for i in range(nb_holes_side)
+        for j in range(nb_holes_side)
+    ]
+    return polygon(square_points(size)), inner_wires
+
+
+def feature(doc, outer_wire, inner_wires=()):
+    fc_object = doc.addObject("Part::Feature", "Boundary")
+    fc_object.Shape = Part.Compound([Part.Face(outer_wire), outer_wire, *inner_wires])
+    return fc_object
+
+
+def sia_geometry(boundary, plane, lines) -> SiaGeometry:
+    """Same bound box as build_rejoin_table"""
+    bound_box = boundary.Shape.BoundBox
+    bound_box.enlarge(5000)
+    return SiaGeometry(boundary, plane, lines, bound_box)
+
+
+@pytest.mark.parametrize(
+    "points", [star_points(1000), near_collinear_points()], ids=["many_vertices", "near_collinear"]
+)
+def test_clean_vectors(bench, points):
+    bench(lambda: utils.clean_vectors(list(points)))
+
+
+def test_polygon_from_lines(bench):
+    lines = [utils.line_from_edge(edge) for edge in polygon(star_points(1000)).Edges]
+    result = bench(utils.polygon_from_lines, lines, Part.Plane())
+    assert result.isClosed()
+
+
+def test_get_plane(bench, doc):
+    boundary = feature(doc, *holed_wires())
+    plane = bench(utils.get_plane, boundary)
+    assert abs(plane.Axis.z) == pytest.approx(1)
+
+
+def test_is_coplanar(bench, doc):
+    boundary1 = feature(doc, polygon(star_points(1000)))
+    boundary2 = feature(doc, polygon(star_points(1000, center=(20000, 0))))
+    assert bench(utils.is_coplanar, boundary1, boundary2)
+
+
+def test_project_wire_to_plane(bench):
+    plane = Part.Plane(FreeCAD.Vector(0, 0, 100), FreeCAD.Vector(0.1, 0.2, 1))
+    wire = bench(utils.project_wire_to_plane, polygon(star_points(1000)), plane)
+    assert len(wire.Vertexes) == 1000
+
+
+@pytest.mark.parametrize("nb_holes_side", [1, 10])
+def test_generate_boundary_compound(bench, doc, nb_holes_side):
+    outer_wire, inner_wires = holed_wires(nb_holes_side)
+    boundary = doc.addObject("Part::Feature", "Boundary")
+    bench(utils.generate_boundary_compound, boundary, outer_wire, inner_wires)
+    assert len(boundary.Shape.Faces) == 1
+
+
+def test_merged_wires(bench):
+    wire1 = polygon(near_collinear_points(1000, 50))
+    wire2 = polygon(square_points(1000, (1000, 0)))
+    outer_wire, _ = bench(merged_wires, wire1, wire2)
+    assert outer_wire is not None
+
+
+def test_edge_distance_to_edge(bench):
+    edge1 = Part.LineSegment(FreeCAD.Vector(0, 0, 0), FreeCAD.Vector(1000, 0, 0)).toShape()
+    edge2 = Part.LineSegment(FreeCAD.Vector(0, 200, 0), FreeCAD.Vector(1000, 250, 0)).toShape()
+    assert bench(edge_distance_to_edge, edge1, edge2) > 0
+
+
+@pytest.mark.parametrize(
+    "direction", [FreeCAD.Vector(1, 0, 0), FreeCAD.Vector(0, 1, 0)], ids=["parallel", "perpendicular"]
+)
+def test_get_medial_axis(bench, doc, direction):
+    plane = Part.Plane()
+    line1 = Part.Line(FreeCAD.Vector(0, 0, 0), FreeCAD.Vector(1, 0, 0))
+    geo1 = sia_geometry(feature(doc, polygon(square_points(1000))), plane, [line1])
+    line2 = Part.Line(FreeCAD.Vector(0, 200, 0), FreeCAD.Vector(0, 200, 0) + direction)
+    geo2 = sia_geometry(feature(doc, polygon(square_points(1000))), plane, [line2])
+    assert bench(get_medial_axis, geo1, geo2, 0, 0) is not None
@@ -8,8 +8,10 @@ See the LICENSE.TXT file for more details.
 
 Author : Cyril Waechter
 """
+import itertools
 import os
 
+import numpy as np
 import pytest
 from pytest import approx
 
@@ -18,6 +20,7 @@ import FreeCADGui
 
 from freecad.bem import utils
 from freecad.bem.boundaries import (
+    Ground,
     generate_bem_xml_from_file,
     process_test_file,
 )
@@ -54,6 +57,36 @@ def test_model_import_do_not_crash(ifc_path):
     assert bool(generate_bem_xml_from_file(ifc_path).xml)
 
 
+def test_ground_heights_at():
+    ground = Ground.__new__(Ground)
+    # Square ground sloping along x: z = x / 10
+    corners = np.array([(0, 0, 0), (1000, 0, 100), (1000, 1000, 100), (0, 1000, 0)], dtype=float)
+    ground.triangles = corners[np.array([(0, 1, 2), (0, 2, 3)])]
+    heights = ground.heights_at(np.array([(500, 250), (250, 750), (1000, 1000), (2000, 0)], dtype=float))
+    assert heights[:3] == approx([50, 25, 100])
+    assert np.isnan(heights[3])
+
+
+def test_ground_heights_at_many_triangles():
+    ground = Ground.__new__(Ground)
+    # 20 x 20 squares of 100 mm sloping along x and y: z = x / 10 + y / 20
+    squares = []
+    for x, y in itertools.product(range(0, 2000, 100), repeat=2):
+        corners = [(x, y), (x + 100, y), (x + 100, y + 100), (x, y + 100)]
+        squares.append([(cx, cy, cx / 10 + cy / 20) for cx, cy in corners])
+    squares = np.array(squares, dtype=float)
+    ground.triangles = np.concatenate([squares[:, [0, 1, 2]], squares[:, [0, 2, 3]]])
+    points = np.array([(1234, 567), (0, 2000), (1950, 5), (-10, 500)], dtype=float)
+    heights = ground.heights_at(points)
+    assert heights[:3] == approx(points[:3, 0] / 10 + points[:3, 1] / 20)
+    assert np.isnan(heights[3])
+
+
+def test_flat_ground_heights_at():
+    ground = Ground([])
+    assert ground.heights_at(np.array([(500, 250), (-1e6, 1e6)], dtype=float)) == approx([0, 0])
+
+
 COLORS = (
     ("IfcWall", (0.7, 0.3, 0.0, 0.0), "1gbc2T7D95owjIQ62vLUpi"),
     ("IfcWindow", (0.0, 0.7, 1.0, 0.0), "3WWI_X3UT8sBwwvwPJt8VH"),
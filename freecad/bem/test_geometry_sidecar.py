@@ -0,0 +1,47 @@
+# coding: utf8
+"""This module test binary geometry sidecar file round trip
+
+© All rights reserved.
+ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland, Laboratory CNPA, 2019-2020
+
+See the LICENSE.TXT file for more details.
+
+Author : Cyril Waechter
+"""
+import numpy as np
+import pytest
+from pytest import approx
+
+from freecad.bem.geometry_sidecar import GeometrySidecar, GeometrySidecarWriter
+
+OUTER = np.array([(0, 0, 0), (10, 0, 0), (10, 10, 0), (0, 10, 0)], dtype=float)
+HOLE = np.array([(2, 2, 0), (4, 2, 0), (4, 4, 0)], dtype=float)
+WALL = np.array([(0, 0, 0), (0, 0, 3), (5, 0, 3), (5, 0, 0)], dtype=float)
+
+
+def test_round_trip(tmp_path):
+    writer = GeometrySidecarWriter()
+    assert writer.add([OUTER, HOLE]) == 0
+    assert writer.add([WALL]) == 1
+    path = str(tmp_path / "geometry.bin")
+    writer.write(path)
+    sidecar = GeometrySidecar(path)
+    assert len(sidecar) == 2
+    rings = sidecar.rings(0)
+    assert len(rings) == 2
+    assert rings[0] == approx(OUTER)
+    assert rings[1] == approx(HOLE)
+    assert [ring.tolist() for ring in sidecar.rings(1)] == [WALL.tolist()]
+
+
+def test_empty_round_trip(tmp_path):
+    path = str(tmp_path / "geometry.bin")
+    GeometrySidecarWriter().write(path)
+    assert len(GeometrySidecar(path)) == 0
+
+
+def test_not_a_sidecar(tmp_path):
+    path = tmp_path / "geometry.bin"
+    path.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        GeometrySidecar(str(path))
@@ -0,0 +1,28 @@
+# coding: utf8
+"""This module test allocation of generated entities ids
+
+© All rights reserved.
+ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland, Laboratory CNPA, 2019-2020
+
+See the LICENSE.TXT file for more details.
+
+Author : Cyril Waechter
+"""
+from freecad.bem.ids import IdAllocator
+
+
+def test_new():
+    allocator = IdAllocator(41)
+    assert [allocator.new() for _ in range(3)] == [42, 43, 44]
+
+
+def test_allocate_block():
+    allocator = IdAllocator(100)
+    first_base = allocator.allocate_block(10)
+    second_base = allocator.allocate_block(10)
+    assert (first_base, second_base) == (100, 110)
+    assert allocator.new() == 121
+    first_block = IdAllocator(first_base)
+    first_ids = [first_block.new() for _ in range(10)]
+    assert first_ids == list(range(101, 111))
+    assert IdAllocator(second_base).new() == 111
@@ -0,0 +1,59 @@
+# coding: utf8
+"""This module test merge of bimbem xml produced by independent partitions
+
+© All rights reserved.
+ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland, Laboratory CNPA, 2019-2020
+
+See the LICENSE.TXT file for more details.
+
+Author : Cyril Waechter
+"""
+import xml.etree.ElementTree as ET
+
+from freecad.bem.partition import merge_bem_xml
+
+PARTITION_1 = """<bimbem>
+<Spaces><Space><Id>1</Id><Boundaries><Boundary>10</Boundary></Boundaries></Space></Spaces>
+<BuildingElementTypes>
+<BuildingElementType><Id>100</Id><Thickness>0.2</Thickness>
+<ApplicableOccurrence><Id>50</Id><Id>51</Id></ApplicableOccurrence></BuildingElementType>
+</BuildingElementTypes>
+<Materials><LayerSet><Id>200</Id><Layers>
+<Layer><Id>300</Id><Thickness>0.1</Thickness></Layer><Layer><Id>300</Id><Thickness>0.1</Thickness></Layer>
+</Layers></LayerSet></Materials>
+</bimbem>"""
+
+PARTITION_2 = """<bimbem>
+<Spaces><Space><Id>2</Id><Boundaries><Boundary>20</Boundary></Boundaries></Space></Spaces>
+<BuildingElementTypes>
+<BuildingElementType><Id>100</Id><Thickness>0.25</Thickness>
+<ApplicableOccurrence><Id>52</Id><Id>50</Id></ApplicableOccurrence></BuildingElementType>
+</BuildingElementTypes>
+<Materials><LayerSet><Id>200</Id><Layers>
+<Layer><Id>300</Id><Thickness>0.1</Thickness></Layer><Layer><Id>300</Id><Thickness>0.1</Thickness></Layer>
+</Layers></LayerSet></Materials>
+</bimbem>"""
+
+
+def merged():
+    return merge_bem_xml(ET.fromstring(xml) for xml in (PARTITION_1, PARTITION_2))
+
+
+def test_merge_entities_by_id():
+    root = merged()
+    assert [space.findtext("Id") for space in root.iter("Space") if len(space)] == ["1", "2"]
+    assert len(root.findall("BuildingElementTypes/BuildingElementType")) == 1
+
+
+def test_merge_id_lists_as_union():
+    occurences = merged().find("BuildingElementTypes/BuildingElementType/ApplicableOccurrence")
+    assert [item.text for item in occurences] == ["50", "51", "52"]
+
+
+def test_keep_single_value():
+    element_type = merged().find("BuildingElementTypes/BuildingElementType")
+    assert [item.text for item in element_type.findall("Thickness")] == ["0.2"]
+
+
+def test_keep_repeated_parts():
+    assert len(merged().findall("Materials/LayerSet/Layers/Layer")) == 2
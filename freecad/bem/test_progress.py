@@ -0,0 +1,56 @@
+# coding: utf8
+"""This module test delivery of progress events
+
+© All rights reserved.
+ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland, Laboratory CNPA, 2019-2020
+
+See the LICENSE.TXT file for more details.
+
+Author : Cyril Waechter
+"""
+import time
+
+import pytest
+
+from freecad.bem.progress import Progress
+
+
+@pytest.fixture
+def events():
+    received = []
+    Progress.progress_func = lambda *event: received.append(event)
+    yield received
+    Progress.progress_func = None
+    Progress.max_rate = 10
+
+
+def wait_for(events, last_event, timeout: float = 2):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end and (not events or events[-1] != last_event):
+        time.sleep(0.01)
+
+
+def test_synchronous_without_rate(events):
+    Progress.max_rate = 0
+    for pourcentage in range(10):
+        Progress.set(pourcentage, "Step", "")
+    assert [event[0] for event in events] == list(range(10))
+
+
+def test_events_are_coalesced(events):
+    Progress.max_rate = 5
+    for pourcentage in range(50):
+        Progress.set(pourcentage, "Step", "")
+    wait_for(events, (49, "Step", ""))
+    assert events[-1] == (49, "Step", "")
+    assert len(events) < 10
+    assert [event[0] for event in events] == sorted(event[0] for event in events)
+
+
+def test_final_event_is_last(events):
+    Progress.max_rate = 5
+    for pourcentage in range(99):
+        Progress.set(pourcentage, "Step", "")
+    Progress.set(100, "Done", "")
+    time.sleep(0.5)
+    assert events[-1] == (100, "Done", "")
@@ -0,0 +1,66 @@
+# coding: utf8
+"""This module test geometry helpers of utils module
+
+© All rights reserved.
+ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland, Laboratory CNPA, 2019-2020
+
+See the LICENSE.TXT file for more details.
+
+Author : Cyril Waechter
+"""
+import numpy as np
+import pytest
+from pytest import approx
+
+import FreeCAD
+import Part
+
+from freecad.bem import utils
+
+SQUARE = np.array([(0, 0, 0), (1000, 0, 0), (1000, 1000, 0), (0, 1000, 0)], dtype=float)
+
+
+def test_clean_points_remove_duplicated():
+    points = np.array([(0, 0, 0), (0, 0, 0), (1000, 0, 0), (1000, 1000, 0), (0, 1000, 0), (0, 1000, 0)], dtype=float)
+    assert utils.clean_points(points) == approx(SQUARE)
+
+
+def test_clean_points_remove_collinear():
+    points = np.insert(SQUARE, 1, (500, 0, 0), axis=0)
+    assert utils.clean_points(points) == approx(SQUARE)
+
+
+def test_clean_points_remove_back_and_forth():
+    points = np.insert(SQUARE, 1, (1500, 0, 0), axis=0)
+    assert utils.clean_points(points) == approx(SQUARE)
+
+
+def test_polygon_area():
+    assert utils.polygon_area(SQUARE) == approx(10**6)
+    tilted = SQUARE @ np.array([(1, 0, 0), (0, 0.6, 0.8), (0, -0.8, 0.6)])
+    assert utils.polygon_area(tilted) == approx(10**6)
+
+
+def test_newell_normals():
+    vertical = SQUARE[:, [0, 2, 1]]
+    triangle = np.array([(0, 0, 1), (1, 0, 1), (0, 1, 1)], dtype=float)
+    normals = utils.newell_normals([SQUARE, vertical, triangle])
+    assert normals == approx(np.array([(0, 0, 1), (0, -1, 0), (0, 0, 1)]))
+
+
+def test_polygon_from_lines():
+    corners = utils.array_to_vectors(SQUARE)
+    lines = [Part.Line(start, end) for start, end in zip(corners, corners[1:] + corners[:1])]
+    # Move one line so polygon is a trapeze
+    lines[2] = Part.Line(FreeCAD.Vector(0, 1500, 0), FreeCAD.Vector(1000, 1000, 0))
+    wire = utils.polygon_from_lines(lines, Part.Plane())
+    assert wire.isClosed()
+    assert utils.vectors_to_array(v.Point for v in wire.Vertexes) == approx(
+        np.array([(0, 0, 0), (1000, 0, 0), (1000, 1000, 0), (0, 1500, 0)])
+    )
+
+
+def test_polygon_from_parallel_lines():
+    lines = [Part.Line(FreeCAD.Vector(0, y, 0), FreeCAD.Vector(1000, y, 0)) for y in (0, 1000, 2000)]
+    with pytest.raises(utils.ShapeCreationError):
+        utils.polygon_from_lines(lines, Part.Plane())
@@ -0,0 +1,78 @@
+# coding: utf8
+"""This module test time budgets of geometry watchdog
+
+© All rights reserved.
+ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland, Laboratory CNPA, 2019-2020
+
+See the LICENSE.TXT file for more details.
+
+Author : Cyril Waechter
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from freecad.bem.watchdog import BudgetExceeded, Watchdog, WorkerError
+
+
+class GeometryError(Exception):
+    pass
+
+
+def add(value1, value2):
+    return value1 + value2
+
+
+def fail(index):
+    raise GeometryError(index)
+
+
+@pytest.fixture
+def space_budget():
+    Watchdog.configure(space_timeout=0)
+    yield
+    Watchdog.configure()
+
+
+def test_run_before_any_space(space_budget):
+    assert Watchdog.remaining_time() is None
+    assert not Watchdog.space_expired()
+    assert Watchdog.run(add, 1, 2) == 3
+
+
+def test_run_in_expired_space(space_budget):
+    Watchdog.start_space(SimpleNamespace(Id=1))
+    assert Watchdog.space_expired()
+    with pytest.raises(BudgetExceeded):
+        Watchdog.run(add, 1, 2)
+
+
+def test_run_after_space(space_budget):
+    Watchdog.start_space(SimpleNamespace(Id=1))
+    Watchdog.end_space()
+    assert not Watchdog.space_expired()
+    assert Watchdog.run(add, 1, 2) == 3
+
+
+def test_configure_forget_previous_space(space_budget):
+    Watchdog.start_space(SimpleNamespace(Id=1))
+    Watchdog.configure(space_timeout=0)
+    assert Watchdog.space_id is None
+    assert Watchdog.run(add, 1, 2) == 3
+
+
+def test_worker_error_keep_type():
+    Watchdog.configure(operation_timeout=10)
+    try:
+        with pytest.raises(GeometryError) as err:
+            Watchdog.run(fail, 3)
+        assert err.value.args == (3,)
+        assert Watchdog.run(add, 1, 2) == 3
+    finally:
+        Watchdog.configure()
+
+
+def test_unpicklable_error_arguments():
+    error = WorkerError.from_exception(GeometryError(lambda: None)).rebuild()
+    assert isinstance(error, GeometryError)
+    assert "lambda" in error.args[0]
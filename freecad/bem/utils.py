@@ -8,14 +8,18 @@ See the LICENSE.TXT file for more details.
 
 Author : Cyril Waechter
 """
+import heapq
 import itertools
 import typing
-from typing import Iterable, Any, Generator, List
+from typing import Iterable, Any, Generator, List, Dict, Set
+
+import numpy as np
 
 import FreeCAD
 import Part
 
 from freecad.bem.entities import Root
+from freecad.bem.watchdog import Watchdog
 
 if typing.TYPE_CHECKING:
     from freecad.bem.typing import (
@@ -24,6 +28,144 @@ if typing.TYPE_CHECKING:
 
 TOLERANCE = 0.001
 
+# Names of objects marked as removed, by document name. See remove_later.
+_REMOVED: Dict[str, Set[str]] = {}
+
+# Object registry by document name. See get_registry.
+_REGISTRIES: Dict[str, "ObjectRegistry"] = {}
+
+
+class ObjectRegistry:
+    """Alive objects of a document partitioned by IfcType, by proxy class and by Id.
+    Partitions keep creation order."""
+
+    def __init__(self, doc) -> None:
+        self.by_ifc_type: Dict[str, Dict[str, Part.Feature]] = {}
+        self.by_class: Dict[type, Dict[str, Part.Feature]] = {}
+        self.by_id: Dict[int, Dict[str, Part.Feature]] = {}
+        # Object name: (IfcType, proxy class, Id) under which it is registered
+        self.keys: Dict[str, tuple] = {}
+        self.order: Dict[str, int] = {}
+        self.counter = itertools.count()
+        for fc_object in doc.Objects:
+            if not is_removed(fc_object):
+                self.add(fc_object)
+
+    def add(self, fc_object) -> None:
+        """Register object or update its partitions after IfcType, Proxy or Id changed"""
+        name = fc_object.Name
+        proxy = getattr(fc_object, "Proxy", None)
+        keys = (
+            getattr(fc_object, "IfcType", None),
+            type(proxy) if proxy is not None else None,
+            getattr(fc_object, "Id", None),
+        )
+        old_keys = self.keys.get(name, (None, None, None))
+        self.keys[name] = keys
+        self.order.setdefault(name, next(self.counter))
+        all_partitions = (self.by_ifc_type, self.by_class, self.by_id)
+        for partitions, key, old_key in zip(all_partitions, keys, old_keys):
+            if key == old_key:
+                continue
+            partitions.get(old_key, {}).pop(name, None)
+            if key:
+                partitions.setdefault(key, {})[name] = fc_object
+
+    def discard(self, fc_object) -> None:
+        name = fc_object.Name
+        keys = self.keys.pop(name, None)
+        if not keys:
+            return
+        for partitions, key in zip((self.by_ifc_type, self.by_class, self.by_id), keys):
+            partitions.get(key, {}).pop(name, None)
+
+    def of_ifc_type(self, ifc_type: str) -> List[Part.Feature]:
+        return list(self.by_ifc_type.get(ifc_type, {}).values())
+
+    def of_ifc_types(self, ifc_types: Iterable[str]) -> List[Part.Feature]:
+        """Objects of any of ifc_types in creation order"""
+        partitions = [
+            list(self.by_ifc_type.get(ifc_type, {}).values())
+            for ifc_type in set(ifc_types)
+        ]
+        return list(heapq.merge(*partitions, key=lambda obj: self.order[obj.Name]))
+
+    def of_class(self, by_class) -> List[Part.Feature]:
+        """Objects which proxy is an instance of by_class (a class or a tuple of classes)"""
+        partitions = [
+            list(partition.values())
+            for proxy_class, partition in self.by_class.items()
+            if issubclass(proxy_class, by_class)
+        ]
+        if len(partitions) == 1:
+            return partitions[0]
+        return list(heapq.merge(*partitions, key=lambda obj: self.order[obj.Name]))
+
+    def of_id(self, ifc_id: int) -> List[Part.Feature]:
+        return list(self.by_id.get(ifc_id, {}).values())
+
+
+def get_registry(doc) -> ObjectRegistry:
+    """Registry is built from doc.Objects on first use then maintained by register and
+    remove_later"""
+    registry = _REGISTRIES.get(doc.Name)
+    if registry is None:
+        registry = _REGISTRIES[doc.Name] = ObjectRegistry(doc)
+    return registry
+
+
+def register(fc_object) -> None:
+    """To be called once an object is created or copied and after its IfcType or Id changed"""
+    registry = _REGISTRIES.get(fc_object.Document.Name)
+    if registry is not None:
+        registry.add(fc_object)
+
+
+def forget_registry(doc) -> None:
+    """Drop registry and removed marks eg. when document is closed as its name can be reused"""
+    _REGISTRIES.pop(doc.Name, None)
+    _REMOVED.pop(doc.Name, None)
+
+
+def remove_later(fc_object) -> None:
+    """Mark object as removed. It is skipped by iterations and actually removed from its
+    document by purge_removed at the end of the pipeline stage. Like removeObject, links to it
+    from InnerBoundaries and CorrespondingBoundary are cleared immediately."""
+    _REMOVED.setdefault(fc_object.Document.Name, set()).add(fc_object.Name)
+    registry = _REGISTRIES.get(fc_object.Document.Name)
+    if registry is not None:
+        registry.discard(fc_object)
+    unlink(fc_object)
+
+
+def unlink(fc_object) -> None:
+    """Remove fc_object from InnerBoundaries and CorrespondingBoundary of objects linking to it"""
+    for linking in fc_object.InList:
+        inner_boundaries = getattr(linking, "InnerBoundaries", ())
+        if fc_object in inner_boundaries:
+            linking.InnerBoundaries = [b for b in inner_boundaries if b != fc_object]
+        if getattr(linking, "CorrespondingBoundary", None) == fc_object:
+            linking.CorrespondingBoundary = None
+
+
+def is_removed(fc_object) -> bool:
+    try:
+        return fc_object.Name in _REMOVED.get(fc_object.Document.Name, ())
+    except ReferenceError:
+        return True
+
+
+def alive(fc_objects: Iterable[Part.Feature]) -> List[Part.Feature]:
+    """Filter out objects marked as removed"""
+    return [fc_object for fc_object in fc_objects if not is_removed(fc_object)]
+
+
+def purge_removed(doc) -> None:
+    """Remove in one batch all objects marked as removed in given document"""
+    for name in _REMOVED.pop(doc.Name, ()):
+        if doc.getObject(name):
+            doc.removeObject(name)
+
 
 def append(doc_object, fc_property, value: Any):
     """Intended to manipulate FreeCAD list like properties only"""
@@ -60,16 +202,28 @@ def clean_vectors(vectors: List[FreeCAD.Vector]) -> None:
     """Clean vectors for polygons creation
     Keep only 1 point if 2 consecutive points are equal.
     Remove point if it makes border go back and forth"""
-    i = 0
-    while i < len(vectors):
-        pt1 = vectors[i - 1]
-        pt2 = vectors[i]
-        pt3 = vectors[(i + 1) % len(vectors)]
-        if are_3points_collinear(pt1, pt2, pt3):
-            vectors.pop(i)
-            i = i - 1 if i > 0 else 0
+    vectors[:] = array_to_vectors(clean_points(vectors_to_array(vectors)))
+
+
+def clean_points(points: np.ndarray) -> np.ndarray:
+    """Vectorised version of clean_vectors working on a (n, 3) array of polygon points"""
+    while len(points) >= 3:
+        previous = np.roll(points, 1, axis=0)
+        duplicated = np.linalg.norm(points - previous, axis=1) <= TOLERANCE
+        if duplicated.all():
+            return points[:1]
+        if duplicated.any():
+            points = points[~duplicated]
             continue
-        i += 1
+        dir1 = normalized(points - previous)
+        dir2 = np.roll(dir1, -1, axis=0)
+        collinear = (np.linalg.norm(dir1 - dir2, axis=1) <= TOLERANCE) | (
+            np.linalg.norm(dir1 + dir2, axis=1) <= TOLERANCE
+        )
+        if not collinear.any():
+            break
+        points = points[~collinear]
+    return points
 
 
 def close_vectors(vectors: List[FreeCAD.Vector]) -> None:
@@ -87,22 +241,46 @@ def generate_boundary_compound(
     inner_wires: List[Part.Wire],
 ):
     """Generate boundary compound composed of 1 Face, 1 OuterWire, 0-n InnerWires"""
+    try:
+        face = Watchdog.run(make_face_with_holes, outer_wire, inner_wires)
+    except InnerWireError as err:
+        inner_wire = inner_wires[err.index]
+        b_id = (
+            boundary.Id
+            if isinstance(boundary.Proxy, Root)
+            else boundary.SourceBoundary.Id
+        )
+        raise RuntimeError(
+            f"""Failure. An inner_wire did not cut face correctly in boundary <{b_id}>.
+            OuterWire area = {Part.Face(outer_wire).Area / 10 ** 6},
+            InnerWire area = {Part.Face(inner_wire).Area / 10 ** 6}"""
+        ) from err
+    boundary.Shape = Part.Compound([face, outer_wire, *inner_wires])
+
+
+def make_face_with_holes(outer_wire: Part.Wire, inner_wires: List[Part.Wire]):
+    """Build a face with all its holes in one step.
+    If result is not the expected single face, fallback to cut holes one by one which also
+    identify a failing inner wire. Raise InnerWireError in that case."""
+    if inner_wires:
+        outer_area = Part.Face(outer_wire).Area
+        try:
+            shape = Part.makeFace([outer_wire, *inner_wires], "Part::FaceMakerBullseye")
+            expected_area = outer_area - sum(Part.Face(w).Area for w in inner_wires)
+            if (
+                len(shape.Faces) == 1
+                and abs(shape.Area - expected_area) <= TOLERANCE * outer_area
+            ):
+                return shape.Faces[0]
+        except Part.OCCError:
+            pass
     face = Part.Face(outer_wire)
-    for inner_wire in inner_wires:
+    for index, inner_wire in enumerate(inner_wires):
         new_face = face.cut(Part.Face(inner_wire))
         if not new_face.Area:
-            b_id = (
-                boundary.Id
-                if isinstance(boundary.Proxy, Root)
-                else boundary.SourceBoundary.Id
-            )
-            raise RuntimeError(
-                f"""Failure. An inner_wire did not cut face correctly in boundary <{b_id}>.
-                OuterWire area = {Part.Face(outer_wire).Area / 10 ** 6},
-                InnerWire area = {Part.Face(inner_wire).Area / 10 ** 6}"""
-            )
+            raise InnerWireError(index)
         face = new_face
-    boundary.Shape = Part.Compound([face, outer_wire, *inner_wires])
+    return face
 
 
 def get_axis_by_name(placement, name):
@@ -120,35 +298,35 @@ def get_by_id(ifc_id: int, elements: Iterable[Part.Feature]) -> Part.Feature:
 
 
 def get_object(ifc_entity, doc) -> Part.Feature:
-    entity_id = ifc_entity.id()
-    for element in doc.Objects:
-        try:
-            if element.Id == entity_id:
-                return element
-        except AttributeError:
-            continue
+    for element in get_registry(doc).of_id(ifc_entity.id()):
+        if not is_removed(element):
+            return element
+    return None
 
 
 def get_by_class(doc=FreeCAD.ActiveDocument, by_class=object):
     """Generator throught FreeCAD document element of specific python proxy class"""
-    for element in doc.Objects:
-        try:
-            if isinstance(element.Proxy, by_class):
-                yield element
-        except AttributeError:
-            continue
+    for element in get_registry(doc).of_class(by_class):
+        if not is_removed(element):
+            yield element
 
 
 def get_elements_by_ifctype(
     ifc_type: str, doc=FreeCAD.ActiveDocument
 ) -> Generator[Part.Feature, None, None]:
     """Generator throught FreeCAD document element of specific ifc_type"""
-    for element in doc.Objects:
-        try:
-            if element.IfcType == ifc_type:
-                yield element
-        except (AttributeError, ReferenceError):
-            continue
+    for element in get_registry(doc).of_ifc_type(ifc_type):
+        if not is_removed(element):
+            yield element
+
+
+def get_elements_by_ifctypes(
+    ifc_types: Iterable[str], doc=FreeCAD.ActiveDocument
+) -> Generator[Part.Feature, None, None]:
+    """Same as get_elements_by_ifctype for several ifc types at once"""
+    for element in get_registry(doc).of_ifc_types(ifc_types):
+        if not is_removed(element):
+            yield element
 
 
 def get_boundaries_by_element(element: Part.Feature, doc) -> List[Part.Feature]:
@@ -192,14 +370,6 @@ This error is known to occurs when you model 2 parallel walls instead of a multi
     )
 
 
-def get_host_guid(ifc_entity):
-    return (
-        ifc_entity.FillsVoids[0]
-        .RelatingOpeningElement.VoidsElements[0]
-        .RelatingBuildingElement.GlobalId
-    )
-
-
 def get_in_list_by_id(elements, element_id):
     if element_id == -1:
         return None
@@ -215,8 +385,37 @@ def get_face_normal(face, at_point=None) -> FreeCAD.Vector:
     return face.normalAt(*params)
 
 
-def get_boundary_normal(fc_boundary, at_point=None) -> FreeCAD.Vector:
-    return get_face_normal(fc_boundary.Shape.Faces[0], at_point)
+def get_boundary_normal(fc_boundary) -> FreeCAD.Vector:
+    """Boundary normal computed from its outer wire with Newell's method.
+    Normal is cached on boundary proxy which reset it when boundary shape change."""
+    normal = getattr(getattr(fc_boundary, "Proxy", None), "newell_normal", None)
+    if normal is None:
+        normal = update_boundaries_normals([fc_boundary])[0]
+    return FreeCAD.Vector(*normal)
+
+
+def update_boundaries_normals(boundaries) -> List[tuple]:
+    """Compute normals of all given boundaries at once and cache them on their proxy"""
+    normals = newell_normals(
+        [vectors_to_array(get_boundary_outer_vectors(b)) for b in boundaries]
+    )
+    normals = [tuple(normal) for normal in normals.tolist()]
+    for boundary, normal in zip(boundaries, normals):
+        proxy = getattr(boundary, "Proxy", None)
+        if proxy is not None:
+            proxy.newell_normal = normal
+    return normals
+
+
+def newell_normals(polygons: List[np.ndarray]) -> np.ndarray:
+    """Unit normals of planar polygons given as (n, 3) arrays of consecutive points"""
+    lengths = np.array([len(polygon) for polygon in polygons])
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    points = np.vstack(polygons)
+    following = np.arange(len(points)) + 1
+    following[starts + lengths - 1] = starts
+    cross = np.cross(points, points[following])
+    return normalized(np.add.reduceat(cross, starts, axis=0))
 
 
 def get_plane(fc_boundary) -> Part.Plane:
@@ -233,12 +432,15 @@ def get_plane(fc_boundary) -> Part.Plane:
 def get_area_from_points(points: List[FreeCAD.Vector]) -> float:
     """Return area considering points are consecutive points of a polygon
     Return 0 for invalid polygons"""
-    clean_vectors(points)
-    close_vectors(points)
-    try:
-        return Part.Face(Part.makePolygon(points)).Area
-    except Part.OCCError:
+    array = clean_points(vectors_to_array(points))
+    if len(array) < 3:
         return 0
+    return polygon_area(array)
+
+
+def polygon_area(points: np.ndarray) -> float:
+    """Area of a planar polygon given as a (n, 3) array of consecutive points"""
+    return float(np.linalg.norm(np.cross(points, np.roll(points, -1, axis=0)).sum(axis=0))) / 2
 
 
 def get_vectors_from_shape(shape: Part.Shape):
@@ -285,21 +487,47 @@ def line_from_edge(edge: Part.Edge) -> Part.Line:
 
 
 def polygon_from_lines(lines, base_plane):
-    new_points = []
-    for li1, line1 in enumerate(lines):
-        li2 = li1 - 1
-        line2 = lines[li2]
-        # Need to ensure direction are not same to avoid crash in OCCT 7.4
-        if abs(line1.Direction.dot(line2.Direction)) >= 1 - TOLERANCE:
-            continue
-        new_points.append(base_plane.value(*line1.intersect2d(line2, base_plane)[0]))
-    clean_vectors(new_points)
-    if len(new_points) < 3:
+    """Build a closed polygon from the intersections of consecutive lines.
+    Lines are projected in base_plane 2D frame and all intersections are solved at once."""
+    origin, axes = plane_frame(base_plane)
+    directions = normalized(vectors_to_array(line.Direction for line in lines))
+    locations_2d = (vectors_to_array(line.Location for line in lines) - origin) @ axes.T
+    directions_2d = directions @ axes.T
+    previous_locations = np.roll(locations_2d, 1, axis=0)
+    previous_directions = np.roll(directions_2d, 1, axis=0)
+    # Lines with same direction do not intersect. Also avoid crash in OCCT 7.4
+    parallel = (
+        np.abs(np.einsum("ij,ij->i", directions, np.roll(directions, 1, axis=0)))
+        >= 1 - TOLERANCE
+    )
+    cross = cross_2d(directions_2d, previous_directions)
+    valid = ~parallel & (np.abs(cross) > TOLERANCE**2)
+    params = cross_2d(previous_locations - locations_2d, previous_directions) / np.where(
+        valid, cross, 1
+    )
+    points_2d = locations_2d + params[:, np.newaxis] * directions_2d
+    points = clean_points(origin + points_2d[valid] @ axes)
+    if len(points) < 3:
         raise ShapeCreationError
+    new_points = array_to_vectors(points)
     close_vectors(new_points)
     return Part.makePolygon(new_points)
 
 
+def cross_2d(vectors1: np.ndarray, vectors2: np.ndarray) -> np.ndarray:
+    """z component of cross products of (n, 2) arrays rows"""
+    return vectors1[:, 0] * vectors2[:, 1] - vectors1[:, 1] * vectors2[:, 0]
+
+
+def plane_frame(plane: Part.Plane):
+    """Return plane origin and a (2, 3) array of orthonormal axes lying in the plane"""
+    origin = vectors_to_array([plane.Position])[0]
+    normal = normalized(vectors_to_array([plane.Axis]))[0]
+    helper = np.array([1.0, 0, 0]) if abs(normal[0]) < 0.9 else np.array([0, 1.0, 0])
+    axis_u = normalized(np.cross(normal, helper)[np.newaxis])[0]
+    return origin, np.vstack((axis_u, np.cross(normal, axis_u)))
+
+
 def project_wire_to_plane(wire, plane) -> Part.Wire:
     new_vectors = [
         v.Point.projectToPlane(plane.Position, plane.Axis) for v in wire.Vertexes
@@ -346,6 +574,22 @@ def are_3points_collinear(
     return dir1.isEqual(dir2, TOLERANCE) or dir1.isEqual(-dir2, TOLERANCE)
 
 
+def normalized(vectors: np.ndarray) -> np.ndarray:
+    """Normalize each row of a (n, 3) array"""
+    return vectors / np.linalg.norm(vectors, axis=1)[:, np.newaxis]
+
+
+def array_to_vectors(array: np.ndarray) -> List[FreeCAD.Vector]:
+    return [FreeCAD.Vector(*point) for point in array.tolist()]
+
+
+def vectors_to_array(vectors: Iterable[FreeCAD.Vector]) -> np.ndarray:
+    """Convert FreeCAD vectors to a (n, 3) array"""
+    return np.array([(vec.x, vec.y, vec.z) for vec in vectors], dtype=float).reshape(
+        -1, 3
+    )
+
+
 def vectors_dir(pt1: FreeCAD.Vector, pt2: FreeCAD.Vector) -> FreeCAD.Vector:
     return (pt2 - pt1).normalize()
 
@@ -356,3 +600,11 @@ class IsTooSmall(BaseException):
 
 class ShapeCreationError(RuntimeError):
     pass
+
+
+class InnerWireError(RuntimeError):
+    """Raised when inner wire at given index in inner wires list do not cut face correctly"""
+
+    def __init__(self, index: int):
+        super().__init__(index)
+        self.index = index
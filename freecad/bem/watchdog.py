@@ -0,0 +1,201 @@
+# coding: utf8
+"""This module supervise risky geometry operations to bound time spent on a single space.
+
+© All rights reserved.
+ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland, Laboratory CNPA, 2019-2020
+
+See the LICENSE.TXT file for more details.
+
+Author : Cyril Waechter
+"""
+import functools
+import importlib
+import multiprocessing
+import pickle
+import time
+from typing import NamedTuple, Optional, Set, Tuple
+
+import Part
+
+from freecad.bem.bem_logging import logger
+
+
+class BudgetExceeded(RuntimeError):
+    pass
+
+
+class BrepShape(NamedTuple):
+    """Shape serialized as BRep to be sent to or received from worker process"""
+
+    brep: str
+
+
+class WorkerError(NamedTuple):
+    """Exception raised in worker process. Exceptions like Part.OCCError cannot be pickled."""
+
+    module: str
+    qualname: str
+    args: Tuple
+    message: str
+
+    @classmethod
+    def from_exception(cls, err: Exception) -> "WorkerError":
+        args = err.args
+        try:
+            pickle.dumps(args)
+        except Exception:  # pylint: disable=broad-except
+            args = (str(err),)
+        return cls(type(err).__module__, type(err).__qualname__, args, repr(err))
+
+    def rebuild(self) -> Exception:
+        """Exception of original type so callers can catch it as if it was raised locally"""
+        try:
+            error_class = functools.reduce(getattr, self.qualname.split("."), importlib.import_module(self.module))
+            return error_class(*self.args)
+        except Exception:  # pylint: disable=broad-except
+            return RuntimeError(self.message)
+
+
+def encode(value):
+    """Replace shapes by their BRep recursively in lists and tuples"""
+    if isinstance(value, Part.Shape):
+        return BrepShape(value.exportBrepToString())
+    if isinstance(value, (list, tuple)):
+        return type(value)(encode(item) for item in value)
+    return value
+
+
+def decode(value):
+    """Restore shapes encoded by encode with their original type (Wire, Face etc…)"""
+    if isinstance(value, BrepShape):
+        shape = Part.Shape()
+        shape.importBrepFromString(value.brep)
+        sub_shapes = getattr(shape, f"{shape.ShapeType}s", None)
+        return sub_shapes[0] if sub_shapes else shape
+    if isinstance(value, (list, tuple)):
+        return type(value)(decode(item) for item in value)
+    return value
+
+
+def worker_loop(connection) -> None:
+    """Execute (function, arguments) tasks received until None is received"""
+    while True:
+        task = connection.recv()
+        if task is None:
+            return
+        func, args = task
+        try:
+            connection.send((True, encode(func(*decode(args)))))
+        except Exception as err:  # pylint: disable=broad-except
+            connection.send((False, WorkerError.from_exception(err)))
+
+
+class Watchdog:
+    """Time budget per space and per geometry operation.
+    When a budget is configured, risky operations run in a supervised worker process which is
+    killed when the budget is exceeded. BudgetExceeded is then raised and caller fallback to a
+    simpler solution (eg. keep boundaries unmerged)."""
+
+    space_timeout: Optional[float] = None
+    operation_timeout: Optional[float] = None
+    # Space being processed. Space budget only applies between start_space and end_space.
+    space_id = None
+    space_start: Optional[float] = None
+    # Ids of spaces for which an operation exceeded its budget. Their geometry may be simplified.
+    exceeded_spaces: Set[int] = set()
+    process = None
+    connection = None
+    worker_unavailable = False
+
+    @classmethod
+    def configure(cls, space_timeout: float = None, operation_timeout: float = None) -> None:
+        """Timeouts are in seconds. None means no limit."""
+        cls.space_timeout = space_timeout
+        cls.operation_timeout = operation_timeout
+        cls.end_space()
+        cls.exceeded_spaces = set()
+        if space_timeout is None and operation_timeout is None:
+            cls.stop()
+
+    @classmethod
+    def start_space(cls, space) -> None:
+        cls.space_id = space.Id
+        cls.space_start = time.monotonic()
+
+    @classmethod
+    def end_space(cls) -> None:
+        cls.space_id = None
+        cls.space_start = None
+
+    @classmethod
+    def space_expired(cls) -> bool:
+        if cls.space_timeout is None or cls.space_start is None:
+            return False
+        return time.monotonic() - cls.space_start > cls.space_timeout
+
+    @classmethod
+    def remaining_time(cls) -> Optional[float]:
+        timeouts = []
+        if cls.operation_timeout is not None:
+            timeouts.append(cls.operation_timeout)
+        if cls.space_timeout is not None and cls.space_start is not None:
+            timeouts.append(cls.space_start + cls.space_timeout - time.monotonic())
+        return min(timeouts) if timeouts else None
+
+    @classmethod
+    def run(cls, func, *args):
+        """Run func(*args) within the remaining time budget"""
+        timeout = cls.remaining_time()
+        if timeout is None:
+            return func(*args)
+        if timeout <= 0:
+            cls.mark_space()
+            raise BudgetExceeded(f"Time budget of space <{cls.space_id}> exceeded before {func.__name__}")
+        if not cls.start_worker():
+            return func(*args)
+        cls.connection.send((func, encode(args)))
+        if not cls.connection.poll(timeout):
+            cls.stop(kill=True)
+            cls.mark_space()
+            logger.warning(f"{func.__name__} exceeded time budget ({timeout:.1f} s) in space <{cls.space_id}>")
+            raise BudgetExceeded(f"{func.__name__} exceeded time budget in space <{cls.space_id}>")
+        success, result = cls.connection.recv()
+        if not success:
+            raise result.rebuild()
+        return decode(result)
+
+    @classmethod
+    def mark_space(cls) -> None:
+        if cls.space_id is not None:
+            cls.exceeded_spaces.add(cls.space_id)
+
+    @classmethod
+    def start_worker(cls) -> bool:
+        """Start worker process if not running. Return False if it cannot be started."""
+        if cls.process and cls.process.is_alive():
+            return True
+        if cls.worker_unavailable:
+            return False
+        try:
+            method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+            context = multiprocessing.get_context(method)
+            cls.connection, child_connection = context.Pipe()
+            cls.process = context.Process(target=worker_loop, args=(child_connection,), daemon=True)
+            cls.process.start()
+        except (OSError, RuntimeError, ValueError) as err:
+            cls.worker_unavailable = True
+            logger.warning(f"Unable to start geometry worker, time budget not enforced: {err}")
+            return False
+        return True
+
+    @classmethod
+    def stop(cls, kill: bool = False) -> None:
+        if not cls.process:
+            return
+        if kill or not cls.process.is_alive():
+            cls.process.kill()
+        else:
+            cls.connection.send(None)
+        cls.process.join()
+        cls.process = None
+        cls.connection = None